@@ -58,6 +58,11 @@ def goto_index(parent):
     return new_action(parent, 'Index', icon_name='index.png', shortcut='Ctrl+I', slot=parent.goto_index)
 
 
+def goto_file(parent):
+    """Jump to an image found by (part of) its name."""
+    return new_action(parent, 'Go to File', shortcut='Ctrl+F', slot=parent.goto_file)
+
+
 # ---------------------------------------
 # include and exclude names
 # ---------------------------------------
@@ -135,6 +140,36 @@ def set_fingerprint(parent):
     return new_action(parent, 'Fingerprint', icon_name='fingerprint.png', slot=parent.set_fingerprint)
 
 
+def hash_dialog(parent):
+    return new_action(parent, 'Fingerprint Hash', shortcut='Ctrl+H', slot=parent.hash_dialog)
+
+
+def group_near_duplicates(parent):
+    """Group the images of the folder into near-duplicates (by phash)."""
+    return new_action(parent, 'Near Duplicates', shortcut='Ctrl+D', slot=parent.group_near_duplicates)
+
+
+def find_similar(parent):
+    """Find the images similar to the current one (by phash)."""
+    return new_action(parent, 'Find Similar', shortcut='Ctrl+Shift+D', slot=parent.find_similar)
+
+
+def sort_dialog(parent):
+    return new_action(parent, 'Sort', shortcut='Ctrl+S', slot=parent.sort_dialog)
+
+
+def near_dup_browse(parent):
+    """Browse the near-duplicate groups: Alt+Right/Left for the members, Alt+Down/Up for the groups."""
+    return [
+        new_action(parent, 'Next Near Duplicate', shortcut='Alt+Right', slot=lambda: parent.near_dup_browse(1)),
+        new_action(parent, 'Previous Near Duplicate', shortcut='Alt+Left', slot=lambda: parent.near_dup_browse(-1)),
+        new_action(parent, 'Next Near-Duplicate Group', shortcut='Alt+Down',
+                   slot=lambda: parent.near_dup_browse(1, by_group=True)),
+        new_action(parent, 'Previous Near-Duplicate Group', shortcut='Alt+Up',
+                   slot=lambda: parent.near_dup_browse(-1, by_group=True))
+    ]
+
+
 # ---------------------------------------
 # auto zoom
 # ---------------------------------------
@@ -144,3 +179,17 @@ def auto_zoom(parent):
 
 def auto_zoom_dialog(parent):
     return new_action(parent, 'Auto Zoom', icon_name='auto_zoom.png', slot=parent.auto_zoom_dialog)
+
+
+# ---------------------------------------
+# prefetch
+# ---------------------------------------
+def prefetch_dialog(parent):
+    return new_action(parent, 'Prefetch', shortcut='Ctrl+P', slot=parent.prefetch_dialog)
+
+
+# ---------------------------------------
+# alignment of compare folders
+# ---------------------------------------
+def align_dialog(parent):
+    return new_action(parent, 'Compare Alignment', shortcut='Ctrl+L', slot=parent.align_dialog)
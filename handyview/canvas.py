@@ -1,11 +1,21 @@
+import functools
 import os
 from PyQt5 import QtCore
-from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QPixmap
+from PyQt5.QtGui import QColor, QImage
 from PyQt5.QtWidgets import QApplication, QGridLayout, QSplitter, QWidget
 
+from handyview.image_cache import image_cache
+from handyview.prefetch import REDUCED_DECODE, Prefetcher
+from handyview.tiles import TILED_MIN_PIXELS, TiledImageItem
+from handyview.utils import get_folder_mtime
 from handyview.view_scene import HVScene, HVView
 from handyview.widgets import ColorLabel, HVLable, show_msg
 
+# browsing steps within this interval (in ms) are coalesced, see Canvas.dir_browse
+BROWSE_COALESCE_MS = 60
+# keep the images of all the compare folders at the current index decoded, see Canvas.make_resident
+RESIDENT_COMPARE = True
+
 def ensure_child_dir_exists(parent_dir, child_dir):
     # creates parent_dir/child_dir if it doesn't exist
     #
@@ -50,6 +60,8 @@ def move_image_to_subdir(subdir, full_path, pidx_before_moving, undo_buf):
     
 class Canvas(QWidget):
     """Main canvas"""
+    # emitted (from a decode worker) when the full resolution of an image is decoded, see refine_image
+    full_decoded = QtCore.pyqtSignal(object)
 
     def __init__(self, parent, db, num_view=1):
         super(Canvas, self).__init__()
@@ -72,6 +84,33 @@ class Canvas(QWidget):
         # the undo buffer
         self.undo_buf = []
 
+        # decode neighbouring images in the background
+        self.prefetcher = Prefetcher(num_shown=self.num_view)
+        # the last browsing step, decides the direction and stride of prefetching
+        self.browse_step = 1
+        # decode large images at screen resolution first, and refine them when zooming in
+        if REDUCED_DECODE:
+            screen = QApplication.primaryScreen()
+            self.prefetcher.max_size = screen.size() * screen.devicePixelRatio()
+        # refine_image is disabled while show_image updates the views
+        self.showing_image = False
+        # cache keys of the images whose full resolution is being decoded for refine_image
+        self.refining = set()
+        self.full_decoded.connect(self.swap_in_full)
+        # coalesce browsing bursts (key repeat, wheel), see dir_browse
+        self.browse_pending = False
+        self.browse_timer = QtCore.QTimer(self)
+        self.browse_timer.setSingleShot(True)
+        self.browse_timer.setInterval(BROWSE_COALESCE_MS)
+        self.browse_timer.timeout.connect(self.on_browse_timeout)
+        # the images of all the compare folders at the current index, so that toggling
+        # folders (compare_folders) only swaps pixmaps. cache key -> (QPixmap, scale, QImage)
+        self.resident_images = {}
+        self.resident_timer = QtCore.QTimer(self)
+        self.resident_timer.setSingleShot(True)
+        self.resident_timer.setInterval(BROWSE_COALESCE_MS)
+        self.resident_timer.timeout.connect(self.make_resident)
+
         self.show_image(init=True)
 
     def init_widgets_layout(self):
@@ -109,6 +148,8 @@ class Canvas(QWidget):
             self.exclude_names_label = HVLable('', self, 'black', 'Times', 12)
             # comparison folders
             self.comparison_label = HVLable('', self, 'red', 'Times', 12)
+            # image cache statistics
+            self.cache_label = HVLable('', self, 'black', 'Times', 12)
 
         # ---------------------------------------
         # layouts
@@ -159,7 +200,14 @@ class Canvas(QWidget):
             if self.undo_buf:
                 (full_path, img_pidx, subdir) = self.undo_buf.pop()
                 print(f"Restoring {full_path} at pidx {img_pidx}")
+                up_to_date = [not self.db.is_folder_changed(fidx) for fidx in range(self.db.get_folder_len())]
                 os.rename(insert_last_dir(full_path, subdir), full_path)
+                restored = self.db.restore_moved(full_path)
+                if restored is not None:
+                    self.db.fidx, img_pidx = restored
+                    # applied to the path list, the folder is not listed again for it
+                    if up_to_date[restored[0]]:
+                        self.db.record_folder_mtime(restored[0], get_folder_mtime(self.db.get_folder(fidx=restored[0])))
                 self.db.pidx = img_pidx
                 self.show_image()
             else:
@@ -167,11 +215,11 @@ class Canvas(QWidget):
         elif event.key() == QtCore.Qt.Key_Delete:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_deleted', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_deleted', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_Backspace:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(-1)
-            move_image_to_subdir('_deleted', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_deleted', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_C and modifiers == QtCore.Qt.ControlModifier:
                 # copy image to clipboard
                 clipboard = QApplication.clipboard()
@@ -226,107 +274,107 @@ class Canvas(QWidget):
         elif event.key() == QtCore.Qt.Key_A:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_A', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_A', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_B:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_B', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_B', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_C:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_C', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_C', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_D:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_D', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_D', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_E:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_E', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_E', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_F:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_F', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_F', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_G:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_G', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_G', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_H:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_H', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_H', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_I:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_I', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_I', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_J:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_J', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_J', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_K:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_K', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_K', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_L:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_L', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_L', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_M:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_M', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_M', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_N:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_N', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_N', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_O:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_O', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_O', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_P:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_P', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_P', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_Q:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_Q', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_Q', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_R:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_R', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_R', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_S:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_S', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_S', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_T:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_T', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_T', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_U:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_U', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_U', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_V:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_V', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_V', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_W:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_W', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_W', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_X:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_X', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_X', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_Y:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_Y', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_Y', full_path, pidx_before_moving)
         elif event.key() == QtCore.Qt.Key_Z:
             full_path = os.path.abspath(self.img_path)
             pidx_before_moving = self.dir_browse(1)
-            move_image_to_subdir('_Z', full_path, pidx_before_moving, self.undo_buf)
+            self.move_to_subdir('_Z', full_path, pidx_before_moving)
 
     def goto_index(self, index):
         self.db.pidx = index
@@ -336,7 +384,8 @@ class Canvas(QWidget):
         is_same_len, img_len_list = self.db.add_cmp_folder(cmp_path)
         show_str = 'Number for each folder:\n\t' + '\n\t'.join(map(str, img_len_list))
         self.comparison_label.setText(show_str)
-        if is_same_len is False:
+        # folders aligned by names show the missing images as placeholders
+        if is_same_len is False and self.db.is_misaligned():
             msg = f'Comparison folders have differnet number of images.\n{show_str}'
             show_msg('Warning', 'Warning!', msg)
         # refresh
@@ -344,12 +393,49 @@ class Canvas(QWidget):
 
     def update_path_list(self):
         is_same_len, img_len_list = self.db.update_path_list()
+        self.prefetcher.clear()
+        self.resident_images.clear()
         show_str = 'Comparison:\n # for each folder:\n\t' + '\n\t'.join(map(str, img_len_list))
         self.comparison_label.setText(show_str)
-        if is_same_len is False:
+        # folders aligned by names show the missing images as placeholders
+        if is_same_len is False and self.db.is_misaligned():
             msg = f'Comparison folders have differnet number of images.\n{show_str}'
             show_msg('Warning', 'Warning!', msg)
 
+    def move_to_subdir(self, subdir, full_path, pidx_before_moving):
+        """Move the image that was shown before browsing (at pidx_before_moving) to a sub-folder."""
+        undo_len = len(self.undo_buf)
+        fidx = self.db.fidx
+        up_to_date = not self.db.is_folder_changed(fidx)
+        move_image_to_subdir(subdir, full_path, pidx_before_moving, self.undo_buf)
+        if len(self.undo_buf) > undo_len:
+            # it stays in the path list as a tombstone, which browsing skips
+            self.db.set_moved(fidx, pidx_before_moving)
+            # the move is applied to the path list, so the folder is not listed again for it
+            # (unless it was changed by others before)
+            if up_to_date:
+                self.db.record_folder_mtime(fidx, get_folder_mtime(self.db.get_folder(fidx=fidx)))
+
+    def set_overview(self, qscene, tiled_item, qimg):
+        """Use the overview of a tiled image (see TiledImageItem.load_overview) once it is loaded."""
+        if qscene.tiled_item is not tiled_item:
+            # another image is shown
+            return
+        qscene.qimg = qimg
+        if qscene is self.qscenes[0]:
+            self.qimg = qimg
+
+    def show_updated_list(self, img_len_list):
+        """Show the current image again after the path lists are updated in the background."""
+        if len(img_len_list) > 1:
+            show_str = 'Comparison:\n # for each folder:\n\t' + '\n\t'.join(map(str, img_len_list))
+            self.comparison_label.setText(show_str)
+        if self.browse_timer.isActive():
+            # shown when the browsing burst ends
+            self.browse_pending = True
+        else:
+            self.show_image()
+
     def compare_folders(self, step):
         self.db.folder_browse(step)
         self.show_image()
@@ -362,61 +448,109 @@ class Canvas(QWidget):
                 self.comparison_label.setStyleSheet('QLabel {color : black;}')
 
     def show_image(self, init=False):
+        self.showing_image = True
+        self.browse_pending = False
         interval_mode = (self.db.get_folder_len() == 1)
+        if init:
+            width = self.db.get_shape(pidx=self.db.pidx)[0]
+            if width < 500:
+                self.qviews[0].set_zoom(500 // width)
+            else:
+                self.qviews[0].set_zoom(1)
+        # collect the images of all the views first
+        views = []
         for idx, qscene in enumerate(self.qscenes):
             qview = self.qviews[idx]
+            gap = False
             if interval_mode:
                 pidx = self.db.pidx + idx
                 img_path = self.db.get_path(pidx=pidx)[0]
-                width, height = self.db.get_shape(pidx=pidx)
-                file_size = self.db.get_file_size(pidx=pidx)
-                color_type = self.db.get_color_type(pidx=pidx)
+                info = self.db.get_image_info(pidx=pidx)
                 if self.show_fingerprint:
-                    md5, phash = self.db.get_fingerprint(pidx=pidx)
-                    md5_0, phash_0 = self.db.get_fingerprint(pidx=self.db.pidx)
+                    digest, phash = self.db.get_fingerprint(pidx=pidx, compute=False)
             else:
                 fidx = self.db.fidx + idx
-                img_path = self.db.get_path(fidx=fidx)[0]
-                width, height = self.db.get_shape(fidx=fidx)
-                file_size = self.db.get_file_size(fidx=fidx)
-                color_type = self.db.get_color_type(fidx=fidx)
+                img_path, view_fidx, view_pidx = self.db.get_path(fidx=fidx)
+                gap = self.db.is_gap(view_fidx, view_pidx)
+                info = self.db.get_image_info(fidx=fidx)
                 if self.show_fingerprint:
-                    md5, phash = self.db.get_fingerprint(fidx=fidx)
-                    md5_0, phash_0 = self.db.get_fingerprint(fidx=self.db.fidx)
-
-            def get_parent_dir(path, levels=1):
-                common = path
-                for _ in range(levels + 1):
-                    common = os.path.dirname(common)
-                return os.path.relpath(path, common)
-
-            shown_path = get_parent_dir(img_path, 2).replace('\\', '/')
-            head, tail = os.path.split(shown_path)
-            if interval_mode:
-                shown_idx = self.db.pidx + 1 + idx
-            else:
-                shown_idx = self.db.pidx + 1
-
-            
-            qimg = QImage(img_path)
-            self.img_path = img_path
-            if idx == 0:
-                # for HVView, HVScene show_mouse_color.
-                # only work on the first qimg (main canvas mode)
-                self.qimg = qimg
-                # self.parent.changeTabCaption(f'{img_path}')
-                self.parent.changeTabCaption(f'[{shown_idx:d} / {self.db.get_path_len():d}] {tail}')
-                
+                    digest, phash = self.db.get_fingerprint(fidx=fidx, compute=False)
 
+            width, height = info.width, info.height
             # --------------- auto zoom scale ratio -------------------
             if self.target_zoom_width > 0:
-                qview.set_zoom(self.target_zoom_width / qimg.width())
+                qview.set_zoom(self.target_zoom_width / width)
             # --------------- end of auto zoom scale ratio -------------------
 
             shown_text = []
+            if gap:
+                # the image of the main folder is missing in this (aligned) compare folder
+                shown_text.append(f'Missing: {os.path.basename(img_path)}')
             # show fingerprint
             if self.show_fingerprint:
-                shown_text.append(f'phash,md5: {phash}, {md5}')
+                # filled by the background fingerprinting, see MainWindow.set_fingerprints
+                if digest is None:
+                    shown_text.append(f'phash,{self.db.hash_name}: ...')
+                else:
+                    shown_text.append(f'phash,{self.db.hash_name}: {phash}, {digest}')
+
+            # info of the icon is returned for missing files
+            full_key = info.cache_key if info.path == img_path else None
+            tiled = full_key is not None and width * height >= TILED_MIN_PIXELS
+            decode_size = None
+            if not tiled:
+                decode_size = self.prefetcher.get_decode_size(width, height, qview.zoom)
+            views.append((img_path, width, height, full_key, tiled, decode_size, shown_text))
+
+        # images that are already on screen (or resident) are moved between the views instead of
+        # decoded again, e.g., in interval mode, a step of 1 only exposes one new image
+        on_screen = dict(self.resident_images)
+        for qscene in self.qscenes:
+            if qscene.img_key is not None and qscene.tiled_item is None:
+                on_screen[qscene.img_key] = (qscene.pixmap_item.pixmap(), qscene.pixmap_item.scale(), qscene.qimg)
+
+        # decode the other images of all the views concurrently
+        requests = [(img_path, full_key, decode_size, self.qviews[idx].zoom)
+                    for idx, (img_path, _, _, full_key, tiled, decode_size, _) in enumerate(views)
+                    if not tiled and full_key not in on_screen]
+        decoded = iter(self.prefetcher.get_all(requests))
+
+        # then present all the views together in one update, so that they are never out of sync
+        self.setUpdatesEnabled(False)
+        for idx, qscene in enumerate(self.qscenes):
+            qview = self.qviews[idx]
+            img_path, width, height, full_key, tiled, decode_size, shown_text = views[idx]
+            if tiled and qscene.tiled_item is not None and qscene.tiled_item.key == full_key:
+                # shown again (e.g., after the path list is updated), the loaded tiles are kept
+                qimg = qscene.qimg
+            elif tiled:
+                # huge images are rendered by tiles, only the visible tiles are decoded
+                tiled_item = TiledImageItem(img_path, full_key, width, height)
+                # the overview (for picking colors) is loaded in the background, see set_overview
+                qimg = QImage()
+                tiled_item.overview_ready.connect(functools.partial(self.set_overview, qscene, tiled_item))
+                tiled_item.load_overview()
+                qscene.set_tiled_item(tiled_item, width, height)
+            elif full_key in on_screen:
+                qpixmap, scale, qimg = on_screen[full_key]
+                qscene.set_pixmap(qpixmap, width, height, scale)
+            else:
+                cache_key, qimg = next(decoded)
+                scale = 1
+                if decode_size is not None and not qimg.isNull():
+                    # keep the scene in the coordinates of the full resolution.
+                    # the full resolution is decoded when zooming in, see refine_image
+                    scale = width / qimg.width()
+                qscene.set_pixmap(image_cache.get_pixmap(cache_key, qimg), width, height, scale)
+            qscene.img_path = img_path
+            qscene.img_key = full_key
+            qscene.qimg = qimg
+            self.img_path = img_path
+            if idx == 0:
+                # for HVView, HVScene show_mouse_color.
+                # only work on the first qimg (main canvas mode)
+                self.qimg = qimg
+                self.set_caption(img_path)
 
             if qview.hasFocus():
                 color = 'red'
@@ -424,25 +558,14 @@ class Canvas(QWidget):
                 color = 'green'
             qview.set_shown_text(shown_text, color)
             # qview.viewport().update()
-            qpixmap = QPixmap.fromImage(qimg)
 
             # draw border
-            if not interval_mode and len(self.qscenes) == 1 and self.db.fidx == 0:  # compare mode, the main image
-                painter = QPainter()
-                painter.begin(qpixmap)
-                pen = QPen(QColor(220, 0, 0), 5, QtCore.Qt.SolidLine)
-                painter.setPen(pen)
-                painter.drawRect(0, 0, qpixmap.width(), qpixmap.height())
-                painter.end()
-
-            qscene.clear()
-            qscene.addPixmap(qpixmap)
-            qscene.set_width_height(width, height)
-            # put image always in the center of a QGraphicsView
-            qscene.setSceneRect(0, 0, width, height)
+            # compare mode, the main image
+            qscene.set_border(not interval_mode and len(self.qscenes) == 1 and self.db.fidx == 0)
             # set the scroll bar position, so that it can keep the same position in auto_zoom
             qview.verticalScrollBar().setSliderPosition(qview.vertical_scroll_value)
             qview.horizontalScrollBar().setSliderPosition(qview.horizontal_scroll_value)
+        self.setUpdatesEnabled(True)
 
         # set include and exclude name info
         if self.num_view == 1:
@@ -462,20 +585,212 @@ class Canvas(QWidget):
                 show_str = 'Exclude: None'
                 self.exclude_names_label.setStyleSheet('QLabel {color : black;}')
             self.exclude_names_label.setText(show_str)
+            self.cache_label.setText(image_cache.stats())
 
-        if init:
-            if width < 500:
-                self.qviews[0].set_zoom(500 // width)
-            else:
-                self.qviews[0].set_zoom(1)
+        self.showing_image = False
         for qview in self.qviews:
             qview.set_transform()
 
+        self.prefetch_neighbours()
+        if RESIDENT_COMPARE and self.db.get_folder_len() > 1:
+            self.resident_timer.start()
+        if self.show_fingerprint:
+            # (re)start it for changed path lists, see MainWindow.fingerprint_folders
+            self.window().fingerprint_folders()
+
+    def set_caption(self, img_path):
+        """Show the index and name of the (first) image in the tab caption."""
+
+        def get_parent_dir(path, levels=1):
+            common = path
+            for _ in range(levels + 1):
+                common = os.path.dirname(common)
+            return os.path.relpath(path, common)
+
+        shown_path = get_parent_dir(img_path, 2).replace('\\', '/')
+        head, tail = os.path.split(shown_path)
+        # self.parent.changeTabCaption(f'{img_path}')
+        caption = f'[{self.db.pidx + 1:d} / {self.db.get_path_len():d}] {tail}'
+        near_dup_pos = self.db.get_near_dup_pos()
+        if near_dup_pos is not None:
+            group, member, num_groups, num_members = near_dup_pos
+            caption += f'  (near dup {group + 1}/{num_groups}: {member + 1}/{num_members})'
+        self.parent.changeTabCaption(caption)
+
+    def show_placeholder(self):
+        """Cheap update of the views while the index is moving in a browsing burst.
+
+        It only shows the caption and the images that are already decoded, and
+        does not read anything from disk. Views without a decoded image are
+        left blank until show_image.
+        """
+        for idx, qscene in enumerate(self.qscenes):
+            fidx, pidx = self.get_view_index(idx)
+            img_path = self.db.get_path(fidx, pidx)[0]
+            self.img_path = img_path
+            if idx == 0:
+                self.set_caption(img_path)
+            info = self.db.get_image_info(fidx, pidx, probe=False)
+            cached = image_cache.peek(img_path) if info is not None else None
+            qscene.img_path = img_path
+            # placeholders are not refined
+            qscene.img_key = None
+            if cached is None:
+                qscene.set_blank()
+            else:
+                cache_key, qimg = cached
+                qscene.set_pixmap(
+                    image_cache.get_pixmap(cache_key, qimg), info.width, info.height, scale=info.width / qimg.width())
+                qscene.qimg = qimg
+                if idx == 0:
+                    self.qimg = qimg
+        # move the prefetch window along, pending decodes of the skipped images are cancelled
+        self.prefetch_neighbours()
+
+    def refine_image(self, qview):
+        """Decode the full-resolution image when a view zooms past 1:1 of a reduced decode.
+
+        It is called by HVView.set_transform, e.g., after zoom_in and set_zoom (F1).
+        The full resolution is decoded in the background, and swapped in by
+        swap_in_full when it is done. The reduced one is shown (upscaled) until then.
+        """
+        if self.showing_image:
+            return
+        qscene = self.qscenes[self.qviews.index(qview)]
+        img_key = qscene.img_key
+        if img_key is None or qscene.pixmap_item.scale() == 1 or qview.zoom * qscene.pixmap_item.scale() <= 1:
+            return
+        if img_key in image_cache:
+            self.swap_in_full(img_key)
+        elif img_key not in self.refining:
+            self.refining.add(img_key)
+            future = self.prefetcher.prefetch_full(qscene.img_path)
+            future.add_done_callback(functools.partial(self.on_full_decoded, img_key))
+
+    def on_full_decoded(self, img_key, future):
+        # called in the decode worker (or in refine_image if it is done already)
+        try:
+            self.full_decoded.emit(img_key)
+        except RuntimeError:
+            # the canvas has been deleted
+            pass
+
+    def swap_in_full(self, img_key):
+        """Swap in the full-resolution image (decoded for refine_image) in the views still showing it reduced."""
+        self.refining.discard(img_key)
+        cached = image_cache.get(img_key)
+        if cached is None:
+            # failed to decode, or the image was dropped from the prefetch window
+            return
+        qimg = cached[0]
+        for idx, qscene in enumerate(self.qscenes):
+            item = qscene.pixmap_item
+            if qscene.img_key != img_key or item.scale() == 1:
+                continue
+            item.setPixmap(image_cache.get_pixmap(img_key, qimg))
+            item.setScale(1)
+            qscene.qimg = qimg
+            if idx == 0:
+                self.qimg = qimg
+        if img_key in self.resident_images:
+            self.resident_images[img_key] = (image_cache.get_pixmap(img_key, qimg), 1, qimg)
+
+    def make_resident(self):
+        """Keep the images of all the compare folders at the current index decoded, as pixmaps.
+
+        It is deferred until browsing settles, so that browsing still decodes only the shown
+        images. The images are decoded concurrently (they are usually prefetched already).
+        """
+        if self.browse_timer.isActive():
+            self.resident_timer.start()
+            return
+        requests = []
+        for fidx in range(self.db.get_folder_len()):
+            try:
+                img_path = self.db.get_path(fidx, self.db.pidx)[0]
+            except IndexError:
+                # compare folders may have different lengths
+                continue
+            info = self.db.get_image_info(fidx, self.db.pidx)
+            if info.path != img_path or info.width * info.height >= TILED_MIN_PIXELS:
+                continue
+            decode_size = self.prefetcher.get_decode_size(info.width, info.height, self.qviews[0].zoom)
+            requests.append((img_path, info.cache_key, decode_size, self.qviews[0].zoom, info))
+        resident_images = {}
+        decoded = self.prefetcher.get_all([request[:4] for request in requests])
+        for (_, full_key, _, _, info), (cache_key, qimg) in zip(requests, decoded):
+            if full_key in self.resident_images and self.resident_images[full_key][2].width() >= qimg.width():
+                # keep the refined image
+                resident_images[full_key] = self.resident_images[full_key]
+            elif not qimg.isNull():
+                resident_images[full_key] = (image_cache.get_pixmap(cache_key, qimg), info.width / qimg.width(), qimg)
+        self.resident_images = resident_images
+
+    def get_view_index(self, idx, pidx=None):
+        """Get (fidx, pidx) of the image shown in the idx-th view when the current index is pidx."""
+        if pidx is None:
+            pidx = self.db.pidx
+        if self.db.get_folder_len() == 1:  # interval mode
+            return self.db.fidx, pidx + idx
+        else:
+            return self.db.fidx + idx, pidx
+
+    def get_view_path(self, idx, pidx=None):
+        """Get the image path shown in the idx-th view when the current index is pidx."""
+        fidx, pidx = self.get_view_index(idx, pidx)
+        return self.db.get_path(fidx, pidx)[0]
+
+    def prefetch_neighbours(self):
+        """Decode the images around the current one in the browsing direction.
+
+        With compare folders, the images of all the folders at the current index and its
+        neighbours (±1) are decoded together, see make_resident.
+        """
+        path_len = self.db.get_path_len()
+        folder_len = self.db.get_folder_len()
+        paths = []
+        for offset in [0] + self.prefetcher.get_offsets(self.browse_step, stride=self.db.interval + 1):
+            pidx = self.db.pidx + offset
+            if 0 <= pidx < path_len:
+                for idx in range(self.num_view):
+                    try:
+                        paths.append(self.get_view_path(idx, pidx))
+                    except IndexError:
+                        # compare folders may have different lengths
+                        pass
+        if RESIDENT_COMPARE and folder_len > 1:
+            for pidx in (self.db.pidx, self.db.pidx + 1, self.db.pidx - 1):
+                for fidx in range(folder_len):
+                    try:
+                        paths.append(self.db.get_path(fidx, pidx)[0])
+                    except IndexError:
+                        pass
+        self.prefetcher.prefetch(paths, zoom=self.qviews[0].zoom)
+
     def dir_browse(self, step):
+        """Browse images in the folder.
+
+        Bursts of browsing (key repeat, wheel) are coalesced: the first step is
+        shown at once, and the following steps within BROWSE_COALESCE_MS only
+        show placeholders, until the index stops moving and the image that we
+        land on is shown.
+        """
+        self.browse_step = step
         pidx_before_moving = self.db.path_browse(step)
-        self.show_image()
+        if self.browse_timer.isActive():
+            self.browse_pending = True
+            self.show_placeholder()
+        else:
+            self.show_image()
+        self.browse_timer.start()
         return pidx_before_moving
 
+    def on_browse_timeout(self):
+        if self.browse_pending:
+            self.show_image()
+            # steps queued while showing the image are still in the burst
+            self.browse_timer.start()
+
     def toggle_bg_color(self):
         if self.qview_bg_color == 'white':
             self.qview_bg_color = 'lightgray'
@@ -487,6 +802,6 @@ class Canvas(QWidget):
                 qscene.setBackgroundBrush(QtCore.Qt.white)
 
     def auto_zoom(self):
-        target_zoom_width = self.qimg.width() * self.qviews[0].zoom
+        target_zoom_width = self.qscenes[0].width * self.qviews[0].zoom
         self.target_zoom_width = int(target_zoom_width)
         return self.target_zoom_width
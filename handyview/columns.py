@@ -0,0 +1,359 @@
+"""
+Compact, columnar storage of the per-image metadata of HVDB.
+
+With millions of images, Python lists of strings and objects (one or more
+objects per image) cost hundreds of MB. Here, each folder is an ImageTable of
+numpy columns, so the memory is a few dozen bytes per image:
+
+- paths: interned directory prefixes (int32 ids) and the names packed in one
+  string (int64 offsets), see PathColumn.
+- sizes, mtimes, dimensions, color modes and formats of the image headers,
+  content digests (16 bytes, e.g., md5) and 64-bit phashes.
+- validity masks, since the headers and fingerprints are filled lazily.
+- tombstones of the images moved away (e.g., to _deleted), which browsing
+  skips by a LiveIndex, without touching the filesystem.
+"""
+import numpy as np
+
+
+def split_path(path):
+    """Split a path into the directory prefix (with the trailing separator) and the name."""
+    sep = max(path.rfind('/'), path.rfind('\\')) + 1
+    return path[:sep], path[sep:]
+
+
+class PathColumn():
+    """A read-only sequence of paths with interned directory prefixes.
+
+    It is used as a list of paths (indexing, len, iteration, in, index). The
+    names are packed in one string, each one terminated by a newline, so that
+    they can also be matched all at once by regular expressions, see
+    filters.NameFilter.
+
+    Args:
+        paths (list[str]): Paths.
+    """
+
+    def __init__(self, paths=()):
+        self.dirs = []
+        self._dir_ids = {}
+        ids = []
+        names = []
+        for path in paths:
+            prefix, name = split_path(path)
+            ids.append(self.get_dir_id(prefix))
+            names.append(name)
+        self.ids = np.array(ids, dtype=np.int32)
+        # offsets[i] is the start of the i-th name, and offsets[i + 1] - 1 its end
+        self.offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(name) + 1 for name in names], out=self.offsets[1:])
+        self.names = ''.join(f'{name}\n' for name in names)
+
+    def get_dir_id(self, prefix):
+        dir_id = self._dir_ids.get(prefix)
+        if dir_id is None:
+            dir_id = self._dir_ids[prefix] = len(self.dirs)
+            self.dirs.append(prefix)
+        return dir_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('path index out of range')
+        return self.dirs[self.ids[idx]] + self.names[self.offsets[idx]:self.offsets[idx + 1] - 1]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __contains__(self, path):
+        try:
+            self.index(path)
+        except ValueError:
+            return False
+        return True
+
+    def __eq__(self, other):
+        if not isinstance(other, (PathColumn, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def find_name(self, name):
+        """Indices of all the paths with the given name (in any directory)."""
+        found = []
+        target = f'{name}\n'
+        pos = self.names.find(target)
+        while pos >= 0:
+            # a match should be a whole name
+            if pos == 0 or self.names[pos - 1] == '\n':
+                found.append(int(np.searchsorted(self.offsets, pos)))
+            pos = self.names.find(target, pos + 1)
+        return found
+
+    def index(self, path):
+        """Index of a path. The packed names are searched, without building the paths."""
+        prefix, name = split_path(path)
+        dir_id = self._dir_ids.get(prefix)
+        if dir_id is not None and name:
+            for idx in self.find_name(name):
+                if self.ids[idx] == dir_id:
+                    return idx
+        raise ValueError(f'{path} is not in the path list')
+
+    def take(self, rows):
+        """Get a new PathColumn of the given rows, gathered without building the paths."""
+        rows = np.asarray(rows, dtype=np.int64)
+        column = PathColumn()
+        column.dirs = self.dirs
+        column._dir_ids = self._dir_ids
+        column.ids = self.ids[rows]
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        column.offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=column.offsets[1:])
+        # gather the characters of the names (UTF-32 has a fixed width)
+        chars = np.frombuffer(self.names.encode('utf-32-le'), dtype=np.uint32)
+        index = np.repeat(starts - column.offsets[:-1], lengths) + np.arange(column.offsets[-1])
+        column.names = chars[index].tobytes().decode('utf-32-le')
+        return column
+
+    def concat(self, paths):
+        """Get a new PathColumn of these paths followed by the given ones."""
+        column = PathColumn()
+        column.dirs = list(self.dirs)
+        column._dir_ids = dict(self._dir_ids)
+        ids = []
+        names = []
+        for path in paths:
+            prefix, name = split_path(path)
+            ids.append(column.get_dir_id(prefix))
+            names.append(name)
+        column.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int32)])
+        lengths = np.array([len(name) + 1 for name in names], dtype=np.int64)
+        column.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+        column.names = self.names + ''.join(f'{name}\n' for name in names)
+        return column
+
+    def tolist(self):
+        return list(self)
+
+
+class LiveIndex():
+    """A Fenwick tree over the live (not moved) rows of a table.
+
+    It finds the nearest live row before or after any row in O(log n),
+    however many moved rows are in between.
+
+    Args:
+        live (np.ndarray): Bool mask of the live rows.
+    """
+
+    def __init__(self, live):
+        self.size = len(live)
+        cumsum = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(live, out=cumsum[1:])
+        self.total = int(cumsum[-1])
+        # tree[i] is the number of live rows in (i - lowbit(i), i], 1-based
+        idx = np.arange(1, self.size + 1)
+        self.tree = np.zeros(self.size + 1, dtype=np.int64)
+        self.tree[1:] = cumsum[idx] - cumsum[idx - (idx & -idx)]
+        self.top_bit = 1 << (self.size.bit_length() - 1) if self.size > 0 else 0
+
+    def update(self, row, delta):
+        """Add delta (1 for a row becoming live, -1 for a moved row)."""
+        self.total += delta
+        i = row + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def count(self, row):
+        """Number of live rows before row."""
+        num = 0
+        i = row
+        while i > 0:
+            num += int(self.tree[i])
+            i -= i & -i
+        return num
+
+    def find(self, k):
+        """The k-th (1-based) live row."""
+        pos = 0
+        bit = self.top_bit
+        while bit:
+            if pos + bit <= self.size and self.tree[pos + bit] < k:
+                pos += bit
+                k -= int(self.tree[pos])
+            bit >>= 1
+        return pos
+
+    def next_live(self, row):
+        """The first live row at or after row. None if there is none."""
+        k = self.count(row) + 1
+        return self.find(k) if k <= self.total else None
+
+    def prev_live(self, row):
+        """The last live row at or before row. None if there is none."""
+        k = self.count(row + 1)
+        return self.find(k) if k > 0 else None
+
+
+class ImageTable():
+    """Columns of the metadata of the images in a folder.
+
+    The header columns (size, mtime, width, height, mode, format) are valid
+    where info_valid is set; digest and phash where digest_valid and phash_valid are.
+    moved marks the tombstones of the images moved away by the canvas, which
+    stay in the table so that undo can restore them.
+
+    Args:
+        paths (list[str] | PathColumn): Paths of the images.
+    """
+    # the metadata columns, see take and put
+    COLUMNS = ('size', 'mtime', 'width', 'height', 'mode', 'format', 'digest', 'phash', 'info_valid',
+               'digest_valid', 'phash_valid', 'moved')
+    # interned strings of the mode and format columns
+    _labels = ['']
+    _label_ids = {'': 0}
+
+    def __init__(self, paths=()):
+        self.paths = paths if isinstance(paths, PathColumn) else PathColumn(paths)
+        num = len(self.paths)
+        self.size = np.zeros(num, dtype=np.int64)
+        self.mtime = np.zeros(num, dtype=np.int64)
+        self.width = np.zeros(num, dtype=np.int32)
+        self.height = np.zeros(num, dtype=np.int32)
+        self.mode = np.zeros(num, dtype=np.int16)
+        self.format = np.zeros(num, dtype=np.int16)
+        self.digest = np.zeros((num, 16), dtype=np.uint8)
+        self.phash = np.zeros(num, dtype=np.uint64)
+        self.info_valid = np.zeros(num, dtype=bool)
+        self.digest_valid = np.zeros(num, dtype=bool)
+        self.phash_valid = np.zeros(num, dtype=bool)
+        self.moved = np.zeros(num, dtype=bool)
+        # built with the first tombstone
+        self._live = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    @classmethod
+    def get_label_id(cls, label):
+        label = '' if label is None else label
+        label_id = cls._label_ids.get(label)
+        if label_id is None:
+            label_id = cls._label_ids[label] = len(cls._labels)
+            cls._labels.append(label)
+        return label_id
+
+    def get_info(self, idx):
+        """Get the header columns of an image.
+
+        Returns:
+            tuple | None: (width, height, mode, size, mtime, format). None if it
+                is not filled.
+        """
+        if not self.info_valid[idx]:
+            return None
+        return (int(self.width[idx]), int(self.height[idx]), self._labels[self.mode[idx]], int(self.size[idx]),
+                int(self.mtime[idx]), self._labels[self.format[idx]] or None)
+
+    def set_info(self, idx, width, height, mode, size, mtime, format):
+        self.width[idx] = width
+        self.height[idx] = height
+        self.mode[idx] = self.get_label_id(mode)
+        self.size[idx] = size
+        self.mtime[idx] = mtime
+        self.format[idx] = self.get_label_id(format)
+        self.info_valid[idx] = True
+
+    def get_digest(self, idx):
+        """Get the content hex digest (see fingerprint.hash_file) of an image, None if it is not filled."""
+        if not self.digest_valid[idx]:
+            return None
+        return self.digest[idx].tobytes().hex()
+
+    def set_digest(self, idx, hexdigest):
+        self.digest[idx] = np.frombuffer(bytes.fromhex(hexdigest), dtype=np.uint8)
+        self.digest_valid[idx] = True
+
+    def get_phash(self, idx):
+        """Get the 64-bit phash of an image (as int), None if it is not filled."""
+        if not self.phash_valid[idx]:
+            return None
+        return int(self.phash[idx])
+
+    def set_phash(self, idx, value):
+        self.phash[idx] = value
+        self.phash_valid[idx] = True
+
+    def invalidate(self, idx):
+        """Drop the metadata of an image, e.g., it has been rewritten."""
+        self.info_valid[idx] = False
+        self.digest_valid[idx] = False
+        self.phash_valid[idx] = False
+
+    def set_moved(self, idx, moved=True):
+        """Set (or clear, e.g., by undo) the tombstone of an image."""
+        if self.moved[idx] == moved:
+            return
+        self.moved[idx] = moved
+        if self._live is None:
+            self._live = LiveIndex(~self.moved)
+        else:
+            self._live.update(idx, -1 if moved else 1)
+
+    def nearest_live(self, idx, forward=True):
+        """The nearest image that is not moved, searched in the given direction first.
+
+        Returns:
+            int: Index of the image. idx itself if it is not moved, or if all
+                the images are moved.
+        """
+        if self._live is None or not self.moved[idx]:
+            return idx
+        if forward:
+            found = self._live.next_live(idx)
+            if found is None:
+                found = self._live.prev_live(idx)
+        else:
+            found = self._live.prev_live(idx)
+            if found is None:
+                found = self._live.next_live(idx)
+        return idx if found is None else found
+
+    def take(self, paths, rows):
+        """Get a new table of the given paths, with the metadata of the given rows of this table.
+
+        Args:
+            paths (list[str] | PathColumn): Paths of the new table.
+            rows (list[int]): Row in this table of each path. -1 for paths
+                that are not in this table (their metadata is not valid).
+
+        Returns:
+            ImageTable: The new table.
+        """
+        table = ImageTable(paths)
+        rows = np.asarray(rows, dtype=np.int64)
+        found = rows >= 0
+        src = rows[found]
+        for name in self.COLUMNS:
+            getattr(table, name)[found] = getattr(self, name)[src]
+        if table.moved.any():
+            table._live = LiveIndex(~table.moved)
+        return table
+
+    def put(self, rows, table):
+        """Write the metadata of a table (from take) back to the given rows of this table (-1 rows are skipped)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        found = rows >= 0
+        dst = rows[found]
+        for name in self.COLUMNS:
+            getattr(self, name)[dst] = getattr(table, name)[found]
+        self._live = LiveIndex(~self.moved) if self.moved.any() else None
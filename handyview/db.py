@@ -1,15 +1,104 @@
-import hashlib
-import imagehash
+import bisect
+from itertools import repeat
+import numpy as np
 import os
+import re
 from PIL import Image, ImageFile
 
-from handyview.utils import FORMATS, ROOT_DIR, get_img_list, scandir, sizeof_fmt
+from handyview.columns import ImageTable, split_path
+from handyview.filters import NameFilter
+from handyview.fingerprint import HASH_NAME, get_fingerprint, int_to_phash
+from handyview.name_index import SEARCH_LIMIT, NameIndex
+from handyview.near_dup import NEAR_DUP_DISTANCE, PhashIndex, similarity_order
+from handyview.utils import (FORMATS, ROOT_DIR, get_folder_mtime, get_img_list, natural_key, scandir_parallel,
+                             sizeof_fmt)
 from handyview.widgets import show_msg
 
 # for loading large image file
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 Image.MAX_IMAGE_PIXELS = None
 
+# compare folders are aligned with the main folder by the image names (see HVDB.align_rows):
+# 'stem' (the name without extension), 'name', or None for aligning by position
+ALIGN_BY = 'stem'
+# suffixes stripped from the stems before matching, e.g., for the outputs named img_x4.png or img_rlt.png
+ALIGN_SUFFIXES = ['_x4', '_rlt']
+# order of the main list: 'name' (the natural order of the folder), or 'similarity' (by phash, see
+# near_dup.similarity_order). Compare folders follow it, as they are aligned by names
+SORT_BY = 'name'
+SORT_BYS = ('name', 'similarity')
+
+
+class ImageInfo():
+    """Header information of an image file.
+
+    It is filled by a single stat and a single (lazy) PIL open, which only
+    reads the file header.
+
+    Attributes:
+        path (str): Image path.
+        width (int): Image width.
+        height (int): Image height.
+        mode (str): PIL color mode, e.g., RGB, RGBA, L.
+        size (int): File size in bytes.
+        mtime (int): Modification time in nanoseconds.
+        format (str): PIL format, e.g., JPEG, PNG.
+    """
+    __slots__ = ('path', 'width', 'height', 'mode', 'size', 'mtime', 'format')
+
+    def __init__(self, path, width, height, mode, size, mtime, format):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.size = size
+        self.mtime = mtime
+        self.format = format
+
+    @classmethod
+    def probe(cls, path):
+        """Read the header of an image file.
+
+        Returns:
+            ImageInfo | None: None if the file is missing or cannot be opened.
+        """
+        try:
+            stat = os.stat(path)
+            with Image.open(path) as lazy_img:
+                width, height = lazy_img.size
+                return cls(path, width, height, lazy_img.mode, stat.st_size, stat.st_mtime_ns, lazy_img.format)
+        except OSError:
+            return None
+
+    @property
+    def cache_key(self):
+        """Key in the decoded image cache, the same as image_cache.get_cache_key."""
+        return (self.path, self.mtime, self.size)
+
+
+def get_align_keys(paths, align_by='stem', suffixes=()):
+    """Get the keys (case-insensitive) that align images by names.
+
+    The keys of all the names are got at once, by a regex over the packed names
+    of the PathColumn.
+
+    Args:
+        paths (PathColumn): Paths of the images.
+        align_by (str): 'stem' or 'name'. Default: 'stem'.
+        suffixes (list[str]): Suffixes stripped from the stems. Default: ().
+
+    Returns:
+        list[str]: Key of each image.
+    """
+    names = paths.names.casefold()
+    if align_by == 'stem':
+        # the extensions, then the suffixes (two simple patterns are much faster than one)
+        names = re.sub(r'\.[^.\n]*\n', '\n', names)
+        if suffixes:
+            suffix = '|'.join(re.escape(suffix.casefold()) for suffix in suffixes)
+            names = re.sub(f'(?:{suffix})\n', '\n', names)
+    return names.split('\n')[:-1]
+
 
 class HVDB():
     """HandyView database.
@@ -18,8 +107,15 @@ class HVDB():
     pidx: path list
     """
 
-    def __init__(self, init_path):
+    def __init__(self, init_path, stream=False):
         self.init_path = init_path
+        # if True, the folder listing is left to a background scan (see FolderScanner),
+        # and only the init image is listed until the scan is done
+        self.stream = stream
+        # indices of the folders that are being scanned
+        self.scanning = set()
+        # mtime of each folder when its path list was last updated, see is_folder_changed
+        self.folder_mtimes = {}
         self._fidx = 0  # folder index
         self._pidx = 0  # path index
         self._include_names = None
@@ -31,18 +127,42 @@ class HVDB():
         self.is_same_len = True
 
         self.folder_list = [None]
-        # list of image path list
-        # the first list is the main list
-        self.path_list = [[]]
-        self.file_size_list = [[]]
-        self.md5_list = [[]]
-        self.phash_list = [[]]
+        # the paths and metadata of the shown images in each folder (see ImageTable)
+        # the first table is the main list
+        self.tables = [ImageTable()]
+        # the unfiltered tables, and the rows of the shown images in them (None if the shown
+        # table is the unfiltered one, -1 for the missing images of aligned compare folders), see update_view
+        self.all_tables = [ImageTable()]
+        self.view_rows = [None]
+        # whether each compare folder is aligned with the main folder by names (with gaps), see update_view
+        self.aligned = [False]
+        self.name_filter = NameFilter()
+        # how the compare folders are aligned with the main folder, see align_rows
+        self.align_by = ALIGN_BY
+        self.align_suffixes = list(ALIGN_SUFFIXES)
+        # order of the main list, see sort_rows
+        self.sort_by = SORT_BY
+        self._similarity_order = None
 
         # for selection pos in crop canvas
         self.selection_pos = [0, 0, 0, 0]
 
         self.recursive_scan_folder = False
 
+        # content hash of the fingerprints, see fingerprint.hash_file
+        self.hash_name = HASH_NAME
+
+        # index of the names of the current folder, built by the first find_paths
+        self._name_index = None
+        # index of the phashes of the current folder, built by the first near-duplicate search
+        self._phash_index = None
+        # near-duplicate groups being browsed: the folder, its path list, the pidxs of each group,
+        # and the (group, member) shown, see group_near_duplicates and near_dup_browse
+        self.near_dup_fidx = 0
+        self.near_dup_paths = None
+        self.near_dup_groups = []
+        self.near_dup_pos = (0, 0)
+
         self.get_init_path_list()
 
     def get_init_path_list(self):
@@ -50,7 +170,7 @@ class HVDB():
         # if init_path is a folder, try to get the first image
         if os.path.isdir(self.init_path):
             self.recursive_scan_folder = True
-            self.path_list[0] = list(scandir(self.init_path, suffix=FORMATS, recursive=True, full_path=True))
+            self.set_table(0, ImageTable(scandir_parallel(self.init_path, suffix=FORMATS)))
             self.init_path = self.path_list[0][0]
         else:
             self.recursive_scan_folder = False
@@ -62,12 +182,14 @@ class HVDB():
             folder = os.path.dirname(self.init_path)
             self.folder_list[0] = folder
             # get path list
-            if self.recursive_scan_folder is False:
-                self.path_list[0] = get_img_list(folder, self._include_names, self._exclude_names,
-                                                 self._exact_exclude_names)
-            self.file_size_list[0] = [None] * len(self.path_list[0])
-            self.md5_list[0] = [None] * len(self.path_list[0])
-            self.phash_list[0] = [None] * len(self.path_list[0])
+            self.scanning.clear()
+            if self.recursive_scan_folder is False and self.stream:
+                self.scanning.add(0)
+                self.set_table(0, ImageTable([self.init_path]))
+            elif self.recursive_scan_folder is False:
+                mtime = get_folder_mtime(folder)
+                self.set_table(0, ImageTable(get_img_list(folder)))
+                self.record_folder_mtime(0, mtime)
             # get current pidx
             try:
                 self._pidx = self.path_list[0].index(self.init_path)
@@ -104,23 +226,15 @@ class HVDB():
                 self._pidx = 0
             else:
                 self._pidx = (self.get_path_len() - 1)
-            return pidx_before_moving
-        # does the file we are viewing now (before we move) exist?
-        cur_file_exists = os.path.exists(self.get_path(self._fidx, self._pidx)[0])
-        if self.get_path_len() > 1:
+        elif self.get_path_len() > 1:
             self._pidx += step * (self._interval + 1)
             if self._pidx > (self.get_path_len() - 1):
                 self._pidx = 0
             elif self._pidx < 0:
                 self._pidx = (self.get_path_len() - 1)
-            path = self.get_path(self._fidx, self._pidx)[0]
-        # does the file we reached after the move exist?
-        new_file_exists = os.path.exists(self.get_path(self._fidx, self._pidx)[0])
-        if not(new_file_exists) and not(cur_file_exists) and step in (-1,1):
-            # user is moving within delete files
-            if ((self._pidx>0 and step<1) or (self._pidx<(self.get_path_len() - 1) and step>-1)): 
-                print("Skiping deleted files")
-                self.path_browse(1 if step>0 else -1)
+        # skip the images moved away (e.g., to _deleted) by their tombstones,
+        # without touching the filesystem
+        self._pidx = self.tables[self._fidx].nearest_live(self._pidx, forward=step > 0)
         return pidx_before_moving
 
     def folder_browse(self, step):
@@ -139,38 +253,351 @@ class HVDB():
     def add_cmp_folder(self, cmp_path):
         folder = os.path.dirname(cmp_path)
         self.folder_list.append(folder)
-        paths = get_img_list(folder, self._include_names, self._exclude_names, self._exact_exclude_names)
-        self.path_list.append(paths)
-        self.file_size_list.append([None] * len(paths))
-        self.md5_list.append([None] * len(paths))
-        self.phash_list.append([None] * len(paths))
-        # all the path list should have the same length
-        self.is_same_len = True
-        img_len_list = [len(self.path_list[0])]
-        for img_list in self.path_list[1:]:
-            img_len_list.append(len(img_list))
-            if len(img_list) != img_len_list[0]:
-                self.is_same_len = False
-        return self.is_same_len, img_len_list
+        mtime = get_folder_mtime(folder)
+        self.set_table(len(self.all_tables), ImageTable(get_img_list(folder)))
+        self.record_folder_mtime(len(self.all_tables) - 1, mtime)
+        return self.check_same_len()
 
     def update_path_list(self):
+        """Update the path lists with the changes in the folders.
+
+        The changes (adds, removes, renames) are applied to the tables of the
+        folders, so the cached info and fingerprints of the unchanged images
+        are kept. The current image is kept shown.
+        """
         if self.recursive_scan_folder is False:
+            current_path = self.path_list[self._fidx][self._pidx] if self.get_path_len() > 0 else None
             for idx, folder in enumerate(self.folder_list):
-                paths = get_img_list(folder, self._include_names, self._exclude_names, self._exact_exclude_names)
-                self.path_list[idx] = paths
-                self.file_size_list[idx] = [None] * len(paths)
-                self.md5_list[idx] = [None] * len(paths)
-                self.phash_list[idx] = [None] * len(paths)
+                if idx in self.scanning:
+                    # updated when the scan is done
+                    continue
+                mtime = get_folder_mtime(folder)
+                self.apply_folder_changes(idx, get_img_list(folder), mtime)
+            self.follow_path(current_path)
+        return self.check_same_len()
+
+    def set_rescanned_list(self, fidx, folder, mtime, paths, stale_paths):
+        """Apply the listing of a changed folder, see FolderScanner.rescan.
+
+        The current image is kept shown.
+
+        Returns:
+            tuple | None: The same as check_same_len. None if the folders are
+                changed since the listing is started.
+        """
+        if fidx >= len(self.folder_list) or self.folder_list[fidx] != folder or fidx in self.scanning:
+            return None
+        current_path = self.path_list[self._fidx][self._pidx] if self.get_path_len() > 0 else None
+        self.apply_folder_changes(fidx, paths, mtime, stale_paths)
+        self.follow_path(current_path)
+        return self.check_same_len()
+
+    def is_folder_changed(self, fidx):
+        """Whether files are added, removed or renamed in a folder since its path list was updated.
+
+        It is a single stat of the folder (its mtime), so the folders that did
+        not change are not listed again.
+        """
+        folder = self.folder_list[fidx]
+        if folder is None:
+            # no folder is opened
+            return False
+        mtime = get_folder_mtime(folder)
+        return mtime is None or self.folder_mtimes.get(folder) != mtime
+
+    def record_folder_mtime(self, fidx, mtime):
+        """Record the mtime of a folder whose path list is up to date with it."""
+        if mtime is None:
+            self.folder_mtimes.pop(self.folder_list[fidx], None)
+        else:
+            self.folder_mtimes[self.folder_list[fidx]] = mtime
+
+    def get_probed(self, fidx):
+        """Get (path, mtime, size) of the images of a folder whose headers are cached (see get_image_info)."""
+        self.sync_view(fidx)
+        table = self.all_tables[fidx]
+        rows = np.flatnonzero(table.info_valid).tolist()
+        return [(table.paths[row], int(table.mtime[row]), int(table.size[row])) for row in rows]
+
+    def set_scanned_list(self, fidx, mtime, paths):
+        """Put the complete listing of a background scan in place of the partial path list.
+
+        The current image is kept shown, i.e., pidx is moved to its index in
+        the complete listing.
+        """
+        self.scanning.discard(fidx)
+        current_path = self.path_list[self._fidx][self._pidx] if self.get_path_len() > 0 else None
+        self.apply_folder_changes(fidx, paths, mtime)
+        self.follow_path(current_path)
+        return self.check_same_len()
+
+    def follow_path(self, path):
+        """Move pidx to the index of path after the path list is changed."""
+        if path in self.path_list[self._fidx]:
+            self._pidx = self.path_list[self._fidx].index(path)
+        else:
+            self.pidx = self._pidx
 
-        # all the path list should have the same length
+    def check_same_len(self):
+        # all the path list should have the same length (the aligned ones should have no gaps)
         self.is_same_len = True
         img_len_list = [len(self.path_list[0])]
-        for img_list in self.path_list[1:]:
-            img_len_list.append(len(img_list))
-            if len(img_list) != img_len_list[0]:
+        for fidx in range(1, len(self.tables)):
+            rows = self.view_rows[fidx]
+            img_len_list.append(len(self.path_list[fidx]) if rows is None else int((rows >= 0).sum()))
+            if img_len_list[-1] != img_len_list[0]:
                 self.is_same_len = False
         return self.is_same_len, img_len_list
 
+    def is_gap(self, fidx, pidx):
+        """Whether the image of an aligned compare folder is missing (it is shown as a placeholder)."""
+        rows = self.view_rows[fidx]
+        return rows is not None and rows[pidx] < 0
+
+    def is_misaligned(self):
+        """Whether a compare folder of a different length is paired with the main folder by position."""
+        return any(not self.aligned[fidx] and len(self.path_list[fidx]) != len(self.path_list[0])
+                   for fidx in range(1, len(self.tables)))
+
+    def set_moved(self, fidx, pidx):
+        """Record that an image has been moved away (e.g., to _deleted), see ImageTable.set_moved."""
+        self.tables[fidx].set_moved(pidx)
+
+    def restore_moved(self, full_path):
+        """Clear the tombstone of a moved image that is restored (e.g., by undo).
+
+        It is cleared in the unfiltered table, so the image is shown again even
+        if it is filtered out at the moment.
+
+        Returns:
+            tuple | None: (fidx, pidx) of the image in the shown path list. None
+                if it is not found, or it is not shown (e.g., filtered out).
+        """
+        for fidx, table in enumerate(self.all_tables):
+            self.sync_view(fidx)
+            for row in np.flatnonzero(table.moved):
+                if os.path.abspath(table.paths[row]) != full_path:
+                    continue
+                table.set_moved(row, False)
+                rows = self.view_rows[fidx]
+                if rows is None:
+                    # the shown table is the unfiltered one
+                    return fidx, int(row)
+                pidx = np.flatnonzero(rows == row)
+                if len(pidx) == 0:
+                    return None
+                self.tables[fidx].set_moved(pidx[0], False)
+                return fidx, int(pidx[0])
+        return None
+
+    def clear_cmp_folders(self):
+        """Remove the compare folders, only the main folder is kept."""
+        self.folder_list = self.folder_list[:1]
+        self.tables = self.tables[:1]
+        self.all_tables = self.all_tables[:1]
+        self.view_rows = self.view_rows[:1]
+        self.aligned = self.aligned[:1]
+        self.fidx = 0
+
+    def set_table(self, fidx, table):
+        """Set the unfiltered table of a folder (a new folder if fidx is the number of folders)."""
+        if fidx == len(self.all_tables):
+            self.all_tables.append(table)
+            self.tables.append(table)
+            self.view_rows.append(None)
+            self.aligned.append(False)
+        else:
+            self.all_tables[fidx] = table
+            self.tables[fidx] = table
+            self.view_rows[fidx] = None
+        self.filter_table(fidx)
+
+    def sync_view(self, fidx):
+        """Write the metadata filled in the shown table back to the unfiltered one."""
+        if self.view_rows[fidx] is not None:
+            self.all_tables[fidx].put(self.view_rows[fidx], self.tables[fidx])
+
+    def filter_table(self, fidx):
+        """Show the images of a folder that pass the name filter, as a view of its unfiltered table.
+
+        Compare folders are also aligned with the main folder, so the views of all of them
+        are updated when the main folder is changed.
+        """
+        self.update_view(fidx)
+        if fidx == 0:
+            for cmp_fidx in range(1, len(self.all_tables)):
+                self.update_view(cmp_fidx)
+
+    def update_view(self, fidx):
+        self.sync_view(fidx)
+        table = self.all_tables[fidx]
+        rows = None
+        # the opened image is shown while its folder is being scanned, even if it is filtered out
+        if self.name_filter.active and fidx not in self.scanning:
+            rows = np.flatnonzero(self.name_filter(table.paths))
+        if fidx == 0 and self.sort_by != 'name' and fidx not in self.scanning:
+            rows = self.sort_rows(table, rows)
+        aligned = self.align_rows(fidx, rows) if fidx > 0 and self.align_by is not None else None
+        self.aligned[fidx] = aligned is not None
+        if aligned is not None:
+            # missing images are shown by their paths in the compare folder, i.e., as missing files
+            gaps = np.flatnonzero(aligned < 0)
+            folder = self.folder_list[fidx]
+            main_paths = self.tables[0].paths
+            paths = table.paths.concat([os.path.join(folder, split_path(main_paths[idx])[1]) for idx in gaps.tolist()])
+            path_rows = aligned.copy()
+            path_rows[gaps] = len(table) + np.arange(len(gaps))
+            self.tables[fidx] = table.take(paths.take(path_rows), aligned)
+            self.view_rows[fidx] = aligned
+        elif rows is not None:
+            self.tables[fidx] = table.take(table.paths.take(rows), rows)
+            self.view_rows[fidx] = rows
+        else:
+            self.tables[fidx] = table
+            self.view_rows[fidx] = None
+
+    def align_rows(self, fidx, rows=None):
+        """Align a compare folder with the main list by image names (a hash join).
+
+        The names are normalized by get_align_keys, and looked up in a hash index
+        of the compare folder, so it is O(n). Images of the compare folder that are
+        not in the main list are not shown.
+
+        Args:
+            fidx (int): Index of the compare folder.
+            rows (np.ndarray): Rows of the compare table that pass the name filter.
+                None for all the rows. Default: None.
+
+        Returns:
+            np.ndarray | None: Row in the compare table of each image in the main
+                list, -1 for the missing ones. None if no name matches, e.g.,
+                folders named differently, which are aligned by position.
+        """
+        main_keys = get_align_keys(self.tables[0].paths, self.align_by, self.align_suffixes)
+        keys = get_align_keys(self.all_tables[fidx].paths, self.align_by, self.align_suffixes)
+        rows = range(len(keys)) if rows is None else rows.tolist()
+        # the hash index, built in reverse so that the first image of duplicated keys is used
+        index = dict(zip([keys[row] for row in reversed(rows)], reversed(rows)))
+        aligned = np.fromiter(map(index.get, main_keys, repeat(-1)), dtype=np.int64, count=len(main_keys))
+        if not (aligned >= 0).any():
+            return None
+        return aligned
+
+    def sort_rows(self, table, rows=None):
+        """Sort the rows of the main table by similarity (see near_dup.similarity_order).
+
+        The images not fingerprinted yet are put at the end, in the name order.
+        The order is kept until the path list, the rows or the phashes are changed.
+
+        Args:
+            table (ImageTable): The unfiltered main table.
+            rows (np.ndarray): Rows that pass the name filter. None for all the
+                rows. Default: None.
+
+        Returns:
+            np.ndarray: The sorted rows.
+        """
+        rows = np.arange(len(table)) if rows is None else rows
+        phashes = table.phash[rows]
+        valid = table.phash_valid[rows]
+        cached = self._similarity_order
+        if (cached is None or cached[0] is not table.paths or not np.array_equal(cached[1], rows)
+                or not np.array_equal(cached[2], valid) or not np.array_equal(cached[3], phashes)):
+            hashed = np.flatnonzero(valid)
+            order = np.concatenate([hashed[similarity_order(phashes[hashed])], np.flatnonzero(~valid)])
+            self._similarity_order = (table.paths, rows, valid, phashes, rows[order])
+        return self._similarity_order[4]
+
+    def set_sort_by(self, sort_by):
+        """Change the order of the main list (see SORT_BYS), the current image is kept shown."""
+        self.sort_by = sort_by
+        current_path = self.path_list[self._fidx][self._pidx] if self.get_path_len() > 0 else None
+        self.filter_table(0)
+        self.follow_path(current_path)
+        return self.check_same_len()
+
+    def apply_filters(self):
+        """Apply the (changed) include and exclude names to all the folders.
+
+        The filters work in memory on the unfiltered tables, so the folders are
+        not listed again and the cached metadata is kept.
+        """
+        self.name_filter = NameFilter(self._include_names, self._exclude_names, self._exact_exclude_names)
+        current_path = self.path_list[self._fidx][self._pidx] if self.get_path_len() > 0 else None
+        self.filter_table(0)
+        self.follow_path(current_path)
+        return self.check_same_len()
+
+    def set_alignment(self, align_by, suffixes):
+        """Change how the compare folders are aligned with the main folder, see align_rows."""
+        self.align_by = align_by
+        self.align_suffixes = list(suffixes)
+        current_path = self.path_list[self._fidx][self._pidx] if self.get_path_len() > 0 else None
+        for fidx in range(1, len(self.all_tables)):
+            self.update_view(fidx)
+        self.follow_path(current_path)
+        return self.check_same_len()
+
+    def apply_folder_changes(self, fidx, paths, mtime=None, stale_paths=None):
+        """Apply a new listing of a folder to its table.
+
+        Images moved away by the canvas (tombstones) are kept, so that undo can
+        restore them.
+
+        Args:
+            fidx (int): Folder index.
+            paths (list[str]): The new (naturally sorted) image list of the folder.
+            mtime (int): mtime of the folder before it was listed, see
+                is_folder_changed. Default: None.
+            stale_paths (list[str]): Images rewritten in place, whose cached
+                headers are stale. None for checking all the cached ones (a stat
+                each). Default: None.
+
+        Returns:
+            bool: Whether the path list is changed.
+        """
+        self.sync_view(fidx)
+        table = self.all_tables[fidx]
+        path_list = table.paths
+        changed = path_list != paths
+        if changed:
+            new_paths = set(paths)
+            # rows of the old paths
+            old_rows = {path: row for row, path in enumerate(path_list)}
+            merged = list(paths)
+            # moved images that are kept, inserted in the natural order
+            kept = [path_list[row] for row in np.flatnonzero(table.moved) if path_list[row] not in new_paths]
+            if kept:
+                sort_keys = [natural_key(path) for path in merged]
+                for path in kept:
+                    sort_key = natural_key(path)
+                    pidx = bisect.bisect(sort_keys, sort_key)
+                    sort_keys.insert(pidx, sort_key)
+                    merged.insert(pidx, path)
+            # the added (and the new names of renamed) images have no cached metadata
+            table = table.take(merged, [old_rows.get(path, -1) for path in merged])
+            self.all_tables[fidx] = table
+        # images rewritten in place
+        if stale_paths is None:
+            for pidx in np.flatnonzero(table.info_valid):
+                try:
+                    stat = os.stat(table.paths[pidx])
+                except OSError:
+                    continue
+                if (stat.st_mtime_ns, stat.st_size) != (table.mtime[pidx], table.size[pidx]):
+                    table.invalidate(pidx)
+        else:
+            for path in stale_paths:
+                try:
+                    table.invalidate(table.paths.index(path))
+                except ValueError:
+                    continue
+        self.record_folder_mtime(fidx, mtime)
+        self.tables[fidx] = table
+        self.view_rows[fidx] = None
+        self.filter_table(fidx)
+        return changed
+
     def get_folder(self, folder=None, fidx=None):
         if folder is None:
             if fidx is None:
@@ -195,56 +622,222 @@ class HVDB():
         path = self.path_list[fidx][pidx]
         return path, fidx, pidx
 
-    def get_shape(self, fidx=None, pidx=None):
-        path = self.get_path(fidx, pidx)[0]
-        try:
-            with Image.open(path) as lazy_img:
-                width, height = lazy_img.size
-        except FileNotFoundError:
-            path = os.path.join(ROOT_DIR, 'icon.ico')
-            with Image.open(path) as lazy_img:
-                width, height = lazy_img.size
+    def get_image_info(self, fidx=None, pidx=None, probe=True):
+        """Get the (cached) ImageInfo of an image.
+
+        For missing files (e.g., moved to a sub-folder), the info of the icon is
+        returned, and it is not cached, so that a restored file is read again.
+
+        Args:
+            probe (bool): Whether to read the header if it is not cached yet. If
+                False, None is returned for images not probed yet. Default: True.
+        """
+        path, fidx, pidx = self.get_path(fidx, pidx)
+        table = self.tables[fidx]
+        values = table.get_info(pidx)
+        if values is not None:
+            return ImageInfo(path, *values)
+        if not probe:
+            return None
+        info = ImageInfo.probe(path)
+        if info is None:
             # show_msg('Critical', 'Critical', f'Cannot open {path}')
-        return width, height
+            return ImageInfo.probe(os.path.join(ROOT_DIR, 'icon.ico'))
+        table.set_info(pidx, info.width, info.height, info.mode, info.size, info.mtime, info.format)
+        return info
+
+    def get_shape(self, fidx=None, pidx=None):
+        info = self.get_image_info(fidx, pidx)
+        return info.width, info.height
 
     def get_color_type(self, fidx=None, pidx=None):
-        path = self.get_path(fidx, pidx)[0]
-        try:
-            with Image.open(path) as lazy_img:
-                color_type = lazy_img.mode
-        except FileNotFoundError:
-            path = os.path.join(ROOT_DIR, 'icon.ico')
-            with Image.open(path) as lazy_img:
-                color_type = lazy_img.mode
-            # show_msg('Critical', 'Critical', f'Cannot open {path}')
-        return color_type
+        return self.get_image_info(fidx, pidx).mode
 
     def get_file_size(self, fidx=None, pidx=None):
-        path, fidx, pidx = self.get_path(fidx, pidx)
-        file_size = self.file_size_list[fidx][pidx]
-        if file_size is None:
-            file_size = sizeof_fmt(os.path.getsize(path))
-            self.file_size_list[fidx][pidx] = file_size
-        return file_size
+        return sizeof_fmt(self.get_image_info(fidx, pidx).size)
 
-    def get_fingerprint(self, fidx=None, pidx=None):
+    def get_fingerprint(self, fidx=None, pidx=None, compute=True):
+        """Get the fingerprint (content digest, phash) of an image.
+
+        Args:
+            compute (bool): Whether to compute it (or load it from the fingerprint
+                cache) if it is not filled yet. If False, (None, None) is returned
+                for images not fingerprinted yet, see Fingerprinter. Default: True.
+        """
         path, fidx, pidx = self.get_path(fidx, pidx)
-        # md5
-        md5 = self.md5_list[fidx][pidx]
-        if md5 is None:
-            data = open(path, 'rb').read()
-            md5 = hashlib.md5(data).hexdigest()
-            self.md5_list[fidx][pidx] = md5
-        # phash (perceptual hash)
-        phash = self.phash_list[fidx][pidx]
+        if self.is_gap(fidx, pidx):
+            return (None, None)
+        table = self.tables[fidx]
+        digest, phash = table.get_digest(pidx), table.get_phash(pidx)
+        if digest is None or phash is None:
+            if not compute:
+                return (None, None)
+            digest, phash = get_fingerprint(path, self.hash_name)
+            table.set_digest(pidx, digest)
+            table.set_phash(pidx, phash)
+        return (digest, int_to_phash(phash))
+
+    def set_hash_name(self, hash_name):
+        """Change the content hash of the fingerprints (see fingerprint.hash_file), the digests are computed again."""
+        self.hash_name = hash_name
+        for table in self.all_tables + self.tables:
+            table.digest_valid[:] = False
+
+    def set_fingerprints(self, paths, rows, digests, phashes):
+        """Fill the fingerprints from Fingerprinter.
+
+        Returns:
+            int | None: The folder index. None if the path list is replaced since
+                (the fingerprints are in the fingerprint cache for the next run).
+        """
+        for fidx, table in enumerate(self.tables):
+            if table.paths is paths:
+                for row, digest, phash in zip(rows, digests, phashes):
+                    table.set_digest(row, digest)
+                    table.set_phash(row, phash)
+                return fidx
+        return None
+
+    def find_paths(self, query, limit=SEARCH_LIMIT):
+        """Find the images of the current folder whose names contain query, see NameIndex.search.
+
+        The index is built (in the background) on the first search, and again when the
+        path list is changed. Images moved away are not found.
+
+        Returns:
+            list[tuple]: (pidx, path) of the found images.
+        """
+        table = self.tables[self._fidx]
+        if self._name_index is None or self._name_index.paths is not table.paths:
+            self._name_index = NameIndex(table.paths)
+        return [(pidx, table.paths[pidx]) for pidx in self._name_index.search(query, limit, skip=table.moved)]
+
+    def get_phash_index(self):
+        """Get the PhashIndex of the fingerprinted images of the current folder.
+
+        It is built again when the path list or the filled phashes are changed.
+        Images moved away are not indexed.
+
+        Returns:
+            tuple: (PhashIndex, pidx of each indexed phash, number of images
+                not fingerprinted yet).
+        """
+        table = self.tables[self._fidx]
+        pidxs = np.flatnonzero(table.phash_valid & ~table.moved)
+        phashes = table.phash[pidxs]
+        cached = self._phash_index
+        if (cached is None or cached[0] is not table.paths or not np.array_equal(cached[1], pidxs)
+                or not np.array_equal(cached[2].phashes, phashes)):
+            self._phash_index = (table.paths, pidxs, PhashIndex(phashes))
+        return self._phash_index[2], pidxs, self.get_num_unhashed()
+
+    def get_num_unhashed(self, fidx=None):
+        """Number of the images (not moved away) whose phashes are not filled yet."""
+        table = self.tables[self._fidx if fidx is None else fidx]
+        return int((~table.phash_valid & ~table.moved).sum())
+
+    def set_near_dup_groups(self, groups):
+        self.near_dup_fidx = self._fidx
+        self.near_dup_paths = self.tables[self._fidx].paths
+        self.near_dup_groups = groups
+        self.near_dup_pos = (0, 0)
+
+    def find_similar(self, distance=NEAR_DUP_DISTANCE):
+        """Find the images of the current folder similar to the current image (by phash).
+
+        They are browsed as one near-duplicate group, the current image first and
+        the others by their distances.
+
+        Returns:
+            tuple[int]: Number of the similar images, and of the images not
+                fingerprinted yet (which are not searched).
+        """
+        # the current image is fingerprinted first, if it is not yet
+        try:
+            _, phash = self.get_fingerprint()
+        except (OSError, ValueError):
+            # e.g., a missing file
+            phash = None
+        index, pidxs, num_missing = self.get_phash_index()
         if phash is None:
-            phash = imagehash.phash(Image.open(path))
-            self.phash_list[fidx][pidx] = phash
-        return (md5, phash)
+            found = []
+        else:
+            found, _ = index.search(self.tables[self._fidx].get_phash(self._pidx), distance)
+            found = [pidx for pidx in pidxs[found].tolist() if pidx != self._pidx]
+        self.set_near_dup_groups([np.array([self._pidx] + found, dtype=np.int64)])
+        return len(found), num_missing
+
+    def group_near_duplicates(self, distance=NEAR_DUP_DISTANCE):
+        """Group the images of the current folder into near-duplicates, see PhashIndex.group.
+
+        Returns:
+            tuple[int]: Number of the groups, of the images in them, and of the
+                images not fingerprinted yet (which are not grouped).
+        """
+        index, pidxs, num_missing = self.get_phash_index()
+        groups = [pidxs[group] for group in index.group(distance)]
+        self.set_near_dup_groups(groups)
+        return len(groups), sum(len(group) for group in groups), num_missing
+
+    def near_dup_browse(self, step, by_group=False):
+        """Go to the next (or previous) image of the near-duplicate groups.
+
+        The members are browsed group by group. Images moved away, or removed from
+        the folder since the grouping, are skipped.
+
+        Args:
+            step (int): 1 or -1 (0 for the group being browsed, with by_group).
+            by_group (bool): Go to the first image of the next (or previous) group,
+                instead of the next member. Default: False.
+
+        Returns:
+            bool: Whether an image is found.
+        """
+        groups = self.near_dup_groups
+        if not groups or self.near_dup_fidx >= len(self.tables):
+            return False
+        table = self.tables[self.near_dup_fidx]
+        group, member = self.near_dup_pos
+        for _ in range(sum(len(members) for members in groups)):
+            if by_group:
+                group, member = (group + step) % len(groups), 0
+            else:
+                member += step
+                if member < 0 or member >= len(groups[group]):
+                    group = (group + step) % len(groups)
+                    member = 0 if step > 0 else len(groups[group]) - 1
+            pidx = int(groups[group][member])
+            if table.paths is not self.near_dup_paths:
+                # the path list is changed since, the images are found by their paths
+                try:
+                    pidx = table.paths.index(self.near_dup_paths[pidx])
+                except ValueError:
+                    continue
+            if not table.moved[pidx]:
+                self._fidx, self._pidx = self.near_dup_fidx, pidx
+                self.near_dup_pos = (group, member)
+                return True
+        return False
+
+    def get_near_dup_pos(self):
+        """Get (group, member, number of groups, number of members) if the current
+        image is the near-duplicate being browsed, else None."""
+        if not self.near_dup_groups or self._fidx != self.near_dup_fidx:
+            return None
+        group, member = self.near_dup_pos
+        members = self.near_dup_groups[group]
+        if self.path_list[self._fidx][self._pidx] != self.near_dup_paths[int(members[member])]:
+            return None
+        return group, member, len(self.near_dup_groups), len(members)
 
     def get_folder_len(self):
         return len(self.folder_list)
 
+    @property
+    def path_list(self):
+        """The path list (PathColumn) of each folder."""
+        return [table.paths for table in self.tables]
+
     def get_path_len(self, fidx=None):
         if fidx is None:
             fidx = self._fidx
@@ -0,0 +1,139 @@
+"""
+A persistent index of the image listings of folders.
+
+Listing a huge folder (scandir and the natural sort) is slow, and it is done
+again on every launch. The index keeps the naturally sorted names of the
+images in an SQLite database in CACHE_DIR. An entry is valid as long as the
+mtime of its folder is not changed, i.e., no file is added, removed or renamed.
+Only the names are listed (no stat of each file, which is a round trip on
+network file systems); the headers of the images are read when they are shown.
+
+The entries of folders that are not listed for DIR_INDEX_MAX_AGE (e.g., the
+folders were removed or renamed) are pruned whenever a listing is saved,
+without touching the file system.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from handyview.utils import CACHE_DIR, FORMATS, natural_key
+
+DIR_INDEX = True
+DIR_INDEX_PATH = os.path.join(CACHE_DIR, 'dir_index.sqlite')
+# smaller folders are fast to list, and are not stored
+DIR_INDEX_MIN_IMAGES = 1000
+# entries not used (listed) for this long (in seconds) are pruned
+DIR_INDEX_MAX_AGE = 30 * 24 * 3600
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def scan_images(folder):
+    """List the names of the images of a folder (not recursively).
+
+    Returns:
+        list[str]: Names of the images, naturally sorted.
+    """
+    images = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.name.endswith(FORMATS):
+                continue
+            try:
+                # the type is known from the listing on most file systems, without a stat
+                if not entry.is_file():
+                    continue
+            except OSError:
+                # removed while listing
+                continue
+            images.append(entry.name)
+    # the same order as get_img_list: sorted, then natural sort for numbers in names
+    images.sort()
+    images.sort(key=lambda name: natural_key(os.path.join(folder, name).replace('\\', '/')))
+    return images
+
+
+def _connect():
+    global _initialized
+    os.makedirs(os.path.dirname(DIR_INDEX_PATH), exist_ok=True)
+    conn = sqlite3.connect(DIR_INDEX_PATH, timeout=10)
+    with _init_lock:
+        if not _initialized:
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(folders)')]
+            if columns and 'used' not in columns:
+                # an index of a former version, which is listed again
+                conn.execute('DROP TABLE folders')
+                conn.execute('DROP TABLE IF EXISTS images')
+            conn.execute('CREATE TABLE IF NOT EXISTS folders (folder TEXT PRIMARY KEY, mtime INTEGER, used INTEGER)')
+            conn.execute('CREATE TABLE IF NOT EXISTS images (folder TEXT, pos INTEGER, name TEXT, '
+                         'PRIMARY KEY (folder, pos)) WITHOUT ROWID')
+            conn.commit()
+            _initialized = True
+    return conn
+
+
+def load_index(folder, mtime):
+    """Load the listing of a folder from the index.
+
+    Returns:
+        list[str] | None: Names of the images. None if the folder is not
+            indexed, or it has been changed since (its mtime is not the given one).
+    """
+    with closing(_connect()) as conn, conn:
+        row = conn.execute('SELECT mtime FROM folders WHERE folder = ?', (folder, )).fetchone()
+        if row is None or row[0] != mtime:
+            return None
+        conn.execute('UPDATE folders SET used = ? WHERE folder = ?', (int(time.time()), folder))
+        return [name for name, in conn.execute('SELECT name FROM images WHERE folder = ? ORDER BY pos', (folder, ))]
+
+
+def save_index(folder, mtime, images):
+    """Save the listing of a folder (from scan_images) with the folder mtime read before listing it.
+
+    The entries of the folders not used for DIR_INDEX_MAX_AGE are pruned.
+    """
+    now = int(time.time())
+    with closing(_connect()) as conn, conn:
+        removed = conn.execute('SELECT folder FROM folders WHERE used < ?', (now - DIR_INDEX_MAX_AGE, )).fetchall()
+        conn.executemany('DELETE FROM images WHERE folder = ?', removed)
+        conn.executemany('DELETE FROM folders WHERE folder = ?', removed)
+        conn.execute('DELETE FROM images WHERE folder = ?', (folder, ))
+        conn.execute('INSERT OR REPLACE INTO folders (folder, mtime, used) VALUES (?, ?, ?)', (folder, mtime, now))
+        conn.executemany('INSERT INTO images (folder, pos, name) VALUES (?, ?, ?)',
+                         ((folder, pos, name) for pos, name in enumerate(images)))
+
+
+def list_images(folder):
+    """Get the naturally sorted images of a folder, from the index if it is valid.
+
+    Only the folders whose mtime is changed are listed again. If the index
+    cannot be used (e.g., CACHE_DIR is read-only), the folder is just listed.
+
+    Args:
+        folder (str): Folder path.
+
+    Returns:
+        list[str]: Paths of the images, joined with folder in the same way as
+            scandir(full_path=True).
+    """
+    images = None
+    key = None
+    if DIR_INDEX:
+        try:
+            # read the mtime before listing, so that changes while listing invalidate the index
+            mtime = os.stat(folder).st_mtime_ns
+            key = os.path.realpath(folder)
+            images = load_index(key, mtime)
+        except (OSError, sqlite3.Error):
+            key = None
+    if images is None:
+        images = scan_images(folder)
+        if key is not None and len(images) >= DIR_INDEX_MIN_IMAGES:
+            try:
+                save_index(key, mtime, images)
+            except (OSError, sqlite3.Error):
+                pass
+    return [os.path.join(folder, name) for name in images]
@@ -0,0 +1,143 @@
+"""
+Include and exclude filters of image names, evaluated in memory.
+
+The substring and glob terms are compiled once into one regular expression,
+which is run over all the (newline separated) names of a PathColumn at once,
+so changing a filter on a huge folder neither lists the folder again nor loops
+over the names in Python. They never match a newline, so a match is always
+within one name. Regular expression terms may (e.g., '[^x]' or '\\s'), so they
+are searched in each name separately.
+
+A term is matched against the base name (without extension), as:
+
+- a regular expression (searched), if it starts with 're:', e.g., 're:^img_\\d+$'.
+- a glob pattern (the whole base name), if it starts with 'glob:', e.g., 'glob:*_x4'.
+- a substring, otherwise (as before, also if it has any of '*?[').
+
+Exact exclude names are complete names (with extension) in a set.
+"""
+import numpy as np
+import re
+
+# prefixes of the regular expression and glob terms
+REGEX_PREFIX = 're:'
+GLOB_PREFIX = 'glob:'
+
+
+def glob_to_regex(pattern):
+    """Translate a glob pattern into a regex matching a whole line (fnmatch rules, names never span lines)."""
+    parts = []
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        idx += 1
+        if char == '*':
+            parts.append('[^\n]*')
+        elif char == '?':
+            parts.append('[^\n]')
+        elif char == '[':
+            end = pattern.find(']', idx + 1 if pattern[idx:idx + 1] in ('!', ']') else idx)
+            if end < 0:
+                parts.append(re.escape(char))
+            else:
+                chars = pattern[idx:end].replace('\\', '\\\\')
+                if chars.startswith('!'):
+                    chars = '^\n' + chars[1:]
+                parts.append(f'[{chars}]')
+                idx = end + 1
+        else:
+            parts.append(re.escape(char))
+    return '^' + ''.join(parts) + '$'
+
+
+def compile_term(term):
+    """Regex of a substring or glob term, which never matches a newline."""
+    if term.startswith(GLOB_PREFIX):
+        return glob_to_regex(term[len(GLOB_PREFIX):])
+    return re.escape(term)
+
+
+def match_lines(pattern, text, num_lines):
+    """Get the lines of text (one name each) that a pattern matches.
+
+    Each matched line is replaced by a marker in C (re.sub), and the markers
+    are then found with numpy.
+
+    Args:
+        pattern (re.Pattern): Pattern matching whole lines, see NameFilter.
+        text (str): Newline terminated lines.
+        num_lines (int): Number of lines.
+
+    Returns:
+        np.ndarray: Bool mask of the matched lines.
+    """
+    if num_lines == 0:
+        return np.zeros(0, dtype=bool)
+    marked = np.frombuffer(pattern.sub('\x01', text).encode('utf-8'), dtype=np.uint8)
+    ends = np.flatnonzero(marked == 10)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    return (ends - starts == 1) & (marked[starts] == 1)
+
+
+class NameFilter():
+    """Compiled include / exclude names.
+
+    As before, exact_exclude_names take precedence over include_names, which
+    take precedence over exclude_names.
+
+    Args:
+        include_names (list[str]): Terms, an image is shown if any matches.
+        exclude_names (list[str]): Terms, an image is hidden if any matches.
+        exact_exclude_names (list[str]): Names (with extension) that are hidden.
+    """
+
+    def __init__(self, include_names=None, exclude_names=None, exact_exclude_names=None):
+        self.pattern = None
+        self.regex = None
+        self.include = False
+        self.exact_exclude_names = None
+        if exact_exclude_names is not None:
+            self.exact_exclude_names = set(exact_exclude_names)
+        elif include_names is not None or exclude_names is not None:
+            self.include = include_names is not None
+            terms = include_names if self.include else exclude_names
+            regexes = [term[len(REGEX_PREFIX):] for term in terms if term.startswith(REGEX_PREFIX)]
+            terms = [compile_term(term) for term in terms if not term.startswith(REGEX_PREFIX)]
+            if terms:
+                terms = '|'.join(f'(?:{term})' for term in terms)
+                # matches a whole line that has a match of any term
+                self.pattern = re.compile(f'^[^\n]*?(?:{terms})[^\n]*$', re.MULTILINE)
+            if regexes:
+                self.regex = re.compile('|'.join(f'(?:{regex})' for regex in regexes))
+
+    @property
+    def active(self):
+        return self.pattern is not None or self.regex is not None or self.exact_exclude_names is not None
+
+    def __call__(self, paths):
+        """Get the mask of the shown images.
+
+        Args:
+            paths (PathColumn): Paths of the images.
+
+        Returns:
+            np.ndarray: Bool mask of the shown images.
+        """
+        mask = np.ones(len(paths), dtype=bool)
+        if self.exact_exclude_names is not None:
+            for name in self.exact_exclude_names:
+                mask[paths.find_name(name)] = False
+        elif self.pattern is not None or self.regex is not None:
+            # strip the extensions of all the names at once
+            base_names = re.sub(r'\.[^.\n]*$', '', paths.names, flags=re.MULTILINE)
+            matched = np.zeros(len(paths), dtype=bool)
+            if self.pattern is not None:
+                matched |= match_lines(self.pattern, base_names, len(paths))
+            if self.regex is not None:
+                search = self.regex.search
+                matched |= np.fromiter((search(name) is not None for name in base_names.split('\n')[:-1]),
+                                       dtype=bool, count=len(paths))
+            mask = matched if self.include else ~matched
+        return mask
@@ -0,0 +1,431 @@
+"""
+Fingerprints (content digest and phash) of images, computed in the background
+and kept across sessions.
+
+phash (a DCT of the downscaled image) is CPU-bound Python and numpy work, so
+Fingerprinter computes the fingerprints of whole folders on a process pool,
+i.e., not limited by the GIL, while the GUI shows the ones that are done.
+
+The fingerprints are stored in an SQLite database in CACHE_DIR, keyed by
+(device, inode, size, mtime) of the files, so re-opening a folder (or the
+same files under another path) reuses them, and rewritten files are
+fingerprinted again.
+
+The content digest is hashed by streaming the file in fixed-size chunks, so the
+memory is bounded for huge files (e.g., GB TIFFs). The hash is selectable:
+md5 (compatible with the former digests), blake2b, or xxh3 if xxhash is
+installed. With the 'quick-' variants (e.g., 'quick-xxh3'), only the header
+and blocks sampled across the file are hashed, which is enough to screen
+duplicates in a first pass (files with different quick digests differ).
+
+The phashes of a batch of images are computed at once (see phash_pixels): the
+images are decoded and downscaled by PIL, exactly as imagehash.phash does, and
+the DCT and the medians of the whole batch are a few numpy operations.
+"""
+import hashlib
+import imagehash
+import multiprocessing
+import numpy as np
+import os
+import sqlite3
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from PIL import Image, ImageFile
+from PyQt5 import QtCore
+from PyQt5.QtCore import QObject
+
+from handyview.utils import CACHE_DIR
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# for loading large image file, also in the worker processes (which import this module), so
+# that the fingerprints do not depend on the process computing them
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+Image.MAX_IMAGE_PIXELS = None
+
+FINGERPRINT_CACHE = True
+FINGERPRINT_CACHE_PATH = os.path.join(CACHE_DIR, 'fingerprints.sqlite')
+FINGERPRINT_WORKERS = max((os.cpu_count() or 2) - 1, 1)
+# number of images computed by a task of the process pool
+FINGERPRINT_CHUNK = 16
+
+# content hashes of the fingerprints, see hash_file
+HASH_ALGORITHMS = ('md5', 'blake2b') + (('xxh3', ) if xxhash is not None else ())
+HASH_NAMES = HASH_ALGORITHMS + tuple(f'quick-{algorithm}' for algorithm in HASH_ALGORITHMS)
+HASH_NAME = 'md5'
+HASH_CHUNK_SIZE = 1 << 20
+# the quick hashes cover the first QUICK_HASH_HEAD bytes, and QUICK_HASH_SAMPLES blocks of
+# QUICK_HASH_BLOCK bytes evenly spaced over the rest of the file (the last block included)
+QUICK_HASH_HEAD = 1 << 16
+QUICK_HASH_SAMPLES = 16
+QUICK_HASH_BLOCK = 1 << 12
+
+# the phashes are the same as imagehash.phash(img) (hash_size=8, highfreq_factor=4)
+PHASH_SIZE = 8
+PHASH_IMG_SIZE = 32
+# coefficients closer than this (relative) to the median may be rounded to the other side of it
+PHASH_TIE_TOL = 1e-9
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def phash_to_int(phash):
+    """Pack an ImageHash (8x8 bits) into a 64-bit int, whose hex is the same as str(phash)."""
+    return int.from_bytes(np.packbits(phash.hash.flatten()).tobytes(), 'big')
+
+
+def int_to_phash(value):
+    """Unpack a 64-bit int from phash_to_int into an ImageHash."""
+    bits = np.unpackbits(np.frombuffer(value.to_bytes(8, 'big'), dtype=np.uint8))
+    return imagehash.ImageHash(bits.astype(bool).reshape(8, 8))
+
+
+def get_file_key(path):
+    """Key of a file in the fingerprint cache: (device, inode, size, mtime)."""
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def new_hasher(algorithm):
+    """Get a hash object with 16-byte digests (the digest column of ImageTable)."""
+    if algorithm == 'md5':
+        return hashlib.md5()
+    elif algorithm == 'blake2b':
+        return hashlib.blake2b(digest_size=16)
+    elif algorithm == 'xxh3' and xxhash is not None:
+        return xxhash.xxh3_128()
+    raise ValueError(f'Unsupported hash algorithm: {algorithm}.')
+
+
+def hash_file(path, hash_name=HASH_NAME):
+    """Hash the content of a file, in chunks of HASH_CHUNK_SIZE (the memory is bounded).
+
+    Args:
+        path (str): File path.
+        hash_name (str): One of HASH_NAMES. The 'quick-' ones only hash the
+            header and sampled blocks, see quick_hash_file. Default: HASH_NAME.
+
+    Returns:
+        str: Hex digest.
+    """
+    if hash_name.startswith('quick-'):
+        return quick_hash_file(path, hash_name[len('quick-'):])
+    hasher = new_hasher(hash_name)
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            num = f.readinto(buffer)
+            if not num:
+                break
+            hasher.update(view[:num])
+    return hasher.hexdigest()
+
+
+def quick_hash_file(path, algorithm='md5'):
+    """Hash the size, the header and blocks sampled across a file.
+
+    Files with the same content have the same quick digest, but not the other
+    way round, so the matches should be confirmed by hash_file.
+    """
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher.update(size.to_bytes(8, 'little'))
+        hasher.update(f.read(QUICK_HASH_HEAD))
+        if size > QUICK_HASH_HEAD:
+            offsets = np.linspace(QUICK_HASH_HEAD, max(size - QUICK_HASH_BLOCK, QUICK_HASH_HEAD), QUICK_HASH_SAMPLES)
+            for offset in np.unique(offsets.astype(np.int64)).tolist():
+                f.seek(offset)
+                hasher.update(f.read(QUICK_HASH_BLOCK))
+    return hasher.hexdigest()
+
+
+def get_dct_matrix(size, num_freqs):
+    """The first num_freqs rows of the DCT (type II, not normalized) of scipy.fftpack.dct."""
+    freqs, samples = np.arange(num_freqs)[:, None], np.arange(size)[None, :]
+    return 2 * np.cos(np.pi * freqs * (2 * samples + 1) / (2 * size))
+
+
+_DCT_LOW = get_dct_matrix(PHASH_IMG_SIZE, PHASH_SIZE)
+
+
+def get_phash_pixels(img):
+    """Get the downscaled grayscale pixels of an image that phash is computed on.
+
+    The image is decoded at its full size: reduced decodes (e.g., JPEG draft)
+    give different pixels, and so different phashes.
+    """
+    return np.asarray(img.convert('L').resize((PHASH_IMG_SIZE, PHASH_IMG_SIZE), Image.LANCZOS))
+
+
+def phash_pixels(pixels):
+    """Get the phashes of a batch of images from their pixels (see get_phash_pixels).
+
+    The low frequencies of the DCT of all the images are two matrix products,
+    and the bits are the same as imagehash.phash. The images with coefficients
+    (almost) equal to their medians, e.g., flat images, are hashed by
+    imagehash.phash, since the bits of those depend on the rounding.
+
+    Args:
+        pixels (np.ndarray): uint8 pixels of shape (n, 32, 32).
+
+    Returns:
+        list[int]: 64-bit phashes (see phash_to_int).
+    """
+    coefs = (_DCT_LOW @ pixels.astype(np.float64) @ _DCT_LOW.T).reshape(len(pixels), -1)
+    medians = np.median(coefs, axis=1, keepdims=True)
+    bits = coefs > medians
+    phashes = np.packbits(bits, axis=1).view('>u8')[:, 0].tolist()
+    scales = np.abs(coefs).max(axis=1, keepdims=True) + 1
+    for idx in np.flatnonzero((np.abs(coefs - medians) <= PHASH_TIE_TOL * scales).any(axis=1)).tolist():
+        phashes[idx] = phash_to_int(imagehash.phash(Image.fromarray(pixels[idx])))
+    return phashes
+
+
+def get_phash(path):
+    """Get the phash of an image, as a 64-bit int (see phash_to_int)."""
+    with Image.open(path) as img:
+        return phash_pixels(get_phash_pixels(img)[None])[0]
+
+
+def compute_fingerprints(paths, hash_name=HASH_NAME):
+    """Compute the fingerprints of images, in a worker process.
+
+    Returns:
+        list[tuple | None]: (file key, digest, phash) of each image. None for the
+            files that are missing or cannot be opened.
+    """
+    results, pixels = [], []
+    for path in paths:
+        try:
+            key = get_file_key(path)
+            digest = hash_file(path, hash_name)
+            with Image.open(path) as img:
+                pixels.append(get_phash_pixels(img))
+            results.append((key, digest))
+        except Exception:
+            # e.g., not an image, or a broken one. The other images of the batch are still computed
+            results.append(None)
+    # the phashes of the whole batch at once
+    phashes = iter(phash_pixels(np.stack(pixels)) if pixels else [])
+    return [None if result is None else result + (next(phashes), ) for result in results]
+
+
+def _connect():
+    global _initialized
+    os.makedirs(os.path.dirname(FINGERPRINT_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(FINGERPRINT_CACHE_PATH, timeout=10)
+    with _init_lock:
+        if not _initialized:
+            conn.execute('CREATE TABLE IF NOT EXISTS image_fingerprints (dev INTEGER, ino INTEGER, size INTEGER, '
+                         'mtime INTEGER, hash TEXT, digest BLOB, phash INTEGER, '
+                         'PRIMARY KEY (dev, ino, size, mtime, hash)) WITHOUT ROWID')
+            conn.commit()
+            _initialized = True
+    return conn
+
+
+def load_fingerprint(conn, key, hash_name=HASH_NAME):
+    """Load the fingerprint of a file key from the cache.
+
+    Returns:
+        tuple | None: (digest, phash). None if it is not cached.
+    """
+    row = conn.execute(
+        'SELECT digest, phash FROM image_fingerprints '
+        'WHERE dev = ? AND ino = ? AND size = ? AND mtime = ? AND hash = ?', (*key, hash_name)).fetchone()
+    if row is None:
+        return None
+    # phashes are stored as signed 64-bit ints
+    return row[0].hex(), row[1] & 0xFFFFFFFFFFFFFFFF
+
+
+def save_fingerprints(conn, fingerprints, hash_name=HASH_NAME):
+    """Save (file key, digest, phash) of images to the cache."""
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO image_fingerprints (dev, ino, size, mtime, hash, digest, phash) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((*key, hash_name, bytes.fromhex(digest), phash - (1 << 64) if phash >= 1 << 63 else phash)
+             for key, digest, phash in fingerprints))
+
+
+def get_fingerprint(path, hash_name=HASH_NAME):
+    """Get the fingerprint of an image, from the cache if it is there (it is saved otherwise).
+
+    Returns:
+        tuple: (digest, phash).
+    """
+    key = get_file_key(path)
+    if FINGERPRINT_CACHE:
+        try:
+            with closing(_connect()) as conn:
+                cached = load_fingerprint(conn, key, hash_name)
+        except (OSError, sqlite3.Error):
+            cached = None
+        if cached is not None:
+            return cached
+    digest, phash = hash_file(path, hash_name), get_phash(path)
+    if FINGERPRINT_CACHE:
+        try:
+            with closing(_connect()) as conn:
+                save_fingerprints(conn, [(key, digest, phash)], hash_name)
+        except (OSError, sqlite3.Error):
+            pass
+    return digest, phash
+
+
+class Fingerprinter(QObject):
+    """Fill the fingerprints of whole folders in the background.
+
+    The cached fingerprints are loaded in a background thread, and the others
+    are computed on a process pool. fingerprinted(paths, rows, digests, phashes)
+    is emitted in the GUI thread for each batch, see HVDB.set_fingerprints.
+    """
+    fingerprinted = QtCore.pyqtSignal(object, list, list, list)
+
+    def __init__(self, parent=None):
+        super(Fingerprinter, self).__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hv_fingerprint')
+        self._pool = None
+        # runs started before cancel() stop, and do not emit their results
+        self._generation = 0
+        # the path lists (PathColumn) being fingerprinted, and the hash
+        self._paths = []
+        self._hash_name = None
+        # tasks submitted to the process pool, cancelled by shutdown
+        self._pool_futures = set()
+
+    def start(self, tables, pidx=0, hash_name=HASH_NAME):
+        """Fingerprint the images of the given tables that have no fingerprints yet.
+
+        It does nothing if the same tables are being fingerprinted, so it can be
+        called whenever the images are shown.
+
+        Args:
+            tables (list[ImageTable]): Tables of the folders.
+            pidx (int): The images from pidx on are fingerprinted first.
+            hash_name (str): Content hash, see hash_file. Default: HASH_NAME.
+        """
+        if (hash_name == self._hash_name and len(tables) == len(self._paths)
+                and all(table.paths is paths for table, paths in zip(tables, self._paths))):
+            return
+        self.cancel()
+        self._paths = [table.paths for table in tables]
+        self._hash_name = hash_name
+        jobs = []
+        for table in tables:
+            rows = np.flatnonzero(~(table.digest_valid & table.phash_valid) & ~table.moved)
+            # from pidx on, then the ones before
+            rows = np.roll(rows, -int(np.searchsorted(rows, pidx)))
+            if len(rows) > 0:
+                jobs.append((table.paths, rows.tolist()))
+        if jobs:
+            self._executor.submit(self._run, self._generation, jobs, hash_name)
+
+    def cancel(self):
+        self._generation += 1
+        self._paths = []
+        self._hash_name = None
+
+    def shutdown(self):
+        self.cancel()
+        if self._pool is not None:
+            # shutdown(cancel_futures=True) needs Python 3.9
+            for future in list(self._pool_futures):
+                future.cancel()
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _run(self, generation, jobs, hash_name):
+        try:
+            self._run_jobs(generation, jobs, hash_name)
+        except Exception as error:
+            print(f'Fingerprinting failed: {error!r}')
+            if generation == self._generation:
+                # so that start() runs again
+                self._paths = []
+                self._hash_name = None
+
+    def _run_jobs(self, generation, jobs, hash_name):
+        if self._pool is None:
+            # spawn, since forking a process with (Qt and executor) threads is not safe
+            self._pool = ProcessPoolExecutor(
+                max_workers=FINGERPRINT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        conn = None
+        if FINGERPRINT_CACHE:
+            try:
+                conn = _connect()
+            except (OSError, sqlite3.Error):
+                conn = None
+        futures = {}
+        try:
+            for paths, rows in jobs:
+                for start in range(0, len(rows), FINGERPRINT_CHUNK):
+                    if generation != self._generation:
+                        return
+                    chunk = rows[start:start + FINGERPRINT_CHUNK]
+                    cached = []
+                    missing = []
+                    for row in chunk:
+                        fingerprint = None
+                        if conn is not None:
+                            try:
+                                fingerprint = load_fingerprint(conn, get_file_key(paths[row]), hash_name)
+                            except OSError:
+                                # missing files are not fingerprinted
+                                continue
+                            except sqlite3.Error:
+                                pass
+                        if fingerprint is None:
+                            missing.append(row)
+                        else:
+                            cached.append((row, *fingerprint))
+                    if cached:
+                        self._emit(paths, cached)
+                    if missing:
+                        future = self._pool.submit(compute_fingerprints, [paths[row] for row in missing], hash_name)
+                        futures[future] = (paths, missing)
+                        self._pool_futures.add(future)
+            while futures:
+                if generation != self._generation:
+                    return
+                done, _ = wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    paths, missing = futures.pop(future)
+                    self._pool_futures.discard(future)
+                    try:
+                        fingerprints = future.result()
+                    except BrokenProcessPool:
+                        # e.g., a worker is killed. A new pool is created by the next run
+                        self._pool.shutdown(wait=False)
+                        self._pool = None
+                        raise
+                    except Exception as error:
+                        print(f'Fingerprinting failed: {error!r}')
+                        continue
+                    results = [(row, result) for row, result in zip(missing, fingerprints) if result is not None]
+                    if conn is not None and results:
+                        try:
+                            save_fingerprints(conn, [result for _, result in results], hash_name)
+                        except sqlite3.Error:
+                            pass
+                    self._emit(paths, [(row, digest, phash) for row, (_, digest, phash) in results])
+        finally:
+            for future in futures:
+                future.cancel()
+                self._pool_futures.discard(future)
+            if conn is not None:
+                conn.close()
+
+    def _emit(self, paths, fingerprints):
+        if fingerprints:
+            rows, digests, phashes = zip(*fingerprints)
+            self.fingerprinted.emit(paths, list(rows), list(digests), list(phashes))
@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import sys
 from PyQt5 import QtCore
@@ -9,9 +10,16 @@ import handyview.actions as actions
 from handyview.canvas import Canvas
 # from handyview.canvas_crop import CanvasCrop
 # from handyview.canvas_video import CanvasVideo
-from handyview.db import HVDB
+from handyview.db import HVDB, SORT_BYS
+from handyview.filters import GLOB_PREFIX, REGEX_PREFIX
+from handyview.fingerprint import HASH_NAMES, Fingerprinter
+from handyview.near_dup import MAX_NEAR_DUP_DISTANCE, NEAR_DUP_DISTANCE
 from handyview.utils import ROOT_DIR
-from handyview.widgets import HLine, MessageDialog, show_msg
+from handyview.watcher import FolderScanner, FolderWatcher
+from handyview.widgets import GotoFileDialog, HLine, MessageDialog, show_msg
+
+# help text of the include and exclude name dialogs, see filters.NameFilter
+FILTER_HELP = f'Key word (seprate by ,; {GLOB_PREFIX}*_x4 for a glob, {REGEX_PREFIX}^img for a regex):'
 
 
 class Application(QApplication):
@@ -81,12 +89,27 @@ class MainWindow(QMainWindow):
                 # show the icon image
                 init_path = os.path.join(ROOT_DIR, 'icon.png')
                 self.empty = True
-        # initialize HVDB (handyview database), which stores the path info
-        self.hvdb = HVDB(init_path)
+        # initialize HVDB (handyview database), which stores the path info.
+        # the init image is shown at once, and the folder is listed in the background
+        self.hvdb = HVDB(init_path, stream=True)
 
         self.full_screen = False
         self.canvas_type = 'main'
         self.center_canvas = CenterWidget(self, self.hvdb)
+        # follow the changes in the folders live
+        self.folder_watcher = FolderWatcher(self)
+        self.folder_watcher.folders_changed.connect(self.apply_folder_changes)
+        self.folder_watcher.set_folders(self.hvdb.folder_list)
+        self.folder_scanner = FolderScanner(self)
+        self.folder_scanner.scanned.connect(self.set_scanned_list)
+        self.folder_scanner.rescanned.connect(self.set_rescanned_list)
+        self.scan_folders()
+        # fingerprints of whole folders, computed in the background when they are shown
+        self.fingerprinter = Fingerprinter(self)
+        self.fingerprinter.fingerprinted.connect(self.set_fingerprints)
+        QApplication.instance().aboutToQuit.connect(self.fingerprinter.shutdown)
+        # max Hamming distance of the near duplicates, see near_dup.PhashIndex
+        self.near_dup_distance = NEAR_DUP_DISTANCE
 
         # initialize UI
         # read version from file
@@ -110,6 +133,8 @@ class MainWindow(QMainWindow):
         # refresh and index
         self.toolbar.addAction(actions.refresh(self))
         self.toolbar.addAction(actions.goto_index(self))
+        # go to a file by name (shortcut only)
+        self.addAction(actions.goto_file(self))
         self.toolbar.addSeparator()
         # include and exclude names
         self.toolbar.addAction(actions.include_file_name(self))
@@ -119,6 +144,14 @@ class MainWindow(QMainWindow):
         # others
         self.toolbar.addSeparator()
         self.toolbar.addAction(actions.set_fingerprint(self))
+        # content hash of the fingerprints (shortcut only)
+        self.addAction(actions.hash_dialog(self))
+        # near duplicates (shortcut only)
+        self.addAction(actions.group_near_duplicates(self))
+        self.addAction(actions.find_similar(self))
+        self.addActions(actions.near_dup_browse(self))
+        # order of the images (shortcut only)
+        self.addAction(actions.sort_dialog(self))
 
         # help
         self.toolbar.addSeparator()
@@ -127,6 +160,10 @@ class MainWindow(QMainWindow):
 
         # auto zoom
         self.toolbar.addAction(actions.auto_zoom(self))
+        # prefetch window (shortcut only)
+        self.addAction(actions.prefetch_dialog(self))
+        # alignment of compare folders (shortcut only)
+        self.addAction(actions.align_dialog(self))
 
         self.toolbar.setIconSize(QtCore.QSize(22, 22))
         self.addToolBar(QtCore.Qt.LeftToolBarArea, self.toolbar)
@@ -166,6 +203,8 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.center_canvas.canvas.exclude_names_label, 7, 0, 1, 3)
         layout.addWidget(HLine(), 8, 0, 1, 3)
         layout.addWidget(self.center_canvas.canvas.comparison_label, 9, 0, 1, 3)
+        layout.addWidget(HLine(), 10, 0, 1, 3)
+        layout.addWidget(self.center_canvas.canvas.cache_label, 11, 0, 1, 3)
         # update comparison info (for a second open)
         _, img_len_list = self.hvdb.update_path_list()
         show_str = 'Comparison:\n # for each folder:\n\t' + '\n\t'.join(map(str, img_len_list))
@@ -174,7 +213,7 @@ class MainWindow(QMainWindow):
 
         # for compact space
         blank_qlabel = QLabel()
-        layout.addWidget(blank_qlabel, 10, 0, 20, 3)
+        layout.addWidget(blank_qlabel, 12, 0, 20, 3)
         dockedWidget.setLayout(layout)
 
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.dock_info)
@@ -202,6 +241,8 @@ class MainWindow(QMainWindow):
             if ok:
                 self.hvdb.init_path = key
                 self.hvdb.get_init_path_list()
+                self.folder_watcher.set_folders(self.hvdb.folder_list)
+                self.scan_folders()
                 self.center_canvas.canvas.show_image(init=True)
                 # self.center_canvas.canvas_crop.update_db(self.hvdb)
         self.empty = False
@@ -214,6 +255,8 @@ class MainWindow(QMainWindow):
         if ok:
             self.hvdb.init_path = key
             self.hvdb.get_init_path_list()
+            self.folder_watcher.set_folders(self.hvdb.folder_list)
+            self.scan_folders()
             self.center_canvas.canvas.show_image(init=True)
             # self.center_canvas.canvas_crop.update_db(self.hvdb)
         self.empty = False
@@ -229,6 +272,32 @@ class MainWindow(QMainWindow):
         self.center_canvas.canvas.update_path_list()
         self.center_canvas.canvas.show_image(init=False)
 
+    def apply_folder_changes(self):
+        """List the watched folders that are changed (see FolderWatcher) again in the background."""
+        if self.hvdb.recursive_scan_folder:
+            return
+        for fidx in range(self.hvdb.get_folder_len()):
+            # a stat each, the folders changed only by the canvas itself (e.g., moving images) are up to date
+            if fidx not in self.hvdb.scanning and self.hvdb.is_folder_changed(fidx):
+                self.folder_scanner.rescan(fidx, self.hvdb.get_folder(fidx=fidx), self.hvdb.get_probed(fidx))
+
+    def set_rescanned_list(self, fidx, folder, mtime, paths, stale_paths):
+        updated = self.hvdb.set_rescanned_list(fidx, folder, mtime, paths, stale_paths)
+        if updated is not None:
+            self.center_canvas.canvas.show_updated_list(updated[1])
+
+    def scan_folders(self):
+        """List the folders left to a background scan by HVDB, see set_scanned_list."""
+        self.folder_scanner.cancel()
+        for fidx in sorted(self.hvdb.scanning):
+            self.folder_scanner.scan(fidx, self.hvdb.get_folder(fidx=fidx))
+
+    def set_scanned_list(self, fidx, mtime, paths):
+        if fidx not in self.hvdb.scanning:
+            return
+        _, img_len_list = self.hvdb.set_scanned_list(fidx, mtime, paths)
+        self.center_canvas.canvas.show_updated_list(img_len_list)
+
     def goto_index(self):
         index, ok = QInputDialog.getText(self, 'Go to index', 'Index:', QLineEdit.Normal, '1')
         if ok:
@@ -237,9 +306,20 @@ class MainWindow(QMainWindow):
             elif index.isdigit():
                 index = int(index) - 1
             else:
-                return
+                # go to the first image with the name
+                found = self.hvdb.find_paths(index, limit=1)
+                if not found:
+                    return
+                index = found[0][0]
             self.center_canvas.canvas.goto_index(index)
 
+    def goto_file(self):
+        dialog = GotoFileDialog(self, self.hvdb.find_paths)
+        # start building the name index while typing
+        self.hvdb.find_paths('')
+        if dialog.exec_() and dialog.index is not None:
+            self.center_canvas.canvas.goto_index(dialog.index)
+
     # ---------------------------------------
     # slots: include and exclude names
     # ---------------------------------------
@@ -251,7 +331,7 @@ class MainWindow(QMainWindow):
         else:
             current_include_names = ', '.join(current_include_names)
 
-        include_names, ok = QInputDialog.getText(self, 'Include file name', 'Key word (seprate by ,):',
+        include_names, ok = QInputDialog.getText(self, 'Include file name', FILTER_HELP,
                                                  QLineEdit.Normal, current_include_names)
         if ok:
             if include_names != '':
@@ -259,7 +339,15 @@ class MainWindow(QMainWindow):
                 self.hvdb.exclude_names = None
             else:
                 self.hvdb.include_names = None
-            self.refresh_img_list()
+            self.apply_name_filter()
+
+    def apply_name_filter(self):
+        # should be used in Main Canvas
+        if self.canvas_type != 'main':
+            self.switch_main_canvas()
+        # filtered in memory, the folders are not listed again
+        _, img_len_list = self.hvdb.apply_filters()
+        self.center_canvas.canvas.show_updated_list(img_len_list)
 
     def exclude_file_name(self):
         # show current exclude names as the default values
@@ -269,7 +357,7 @@ class MainWindow(QMainWindow):
         else:
             current_exclude_names = ', '.join(current_exclude_names)
 
-        exclude_names, ok = QInputDialog.getText(self, 'Exclude file name', 'Key word (seprate by ,):',
+        exclude_names, ok = QInputDialog.getText(self, 'Exclude file name', FILTER_HELP,
                                                  QLineEdit.Normal, current_exclude_names)
         if ok:
             if exclude_names != '':
@@ -277,7 +365,7 @@ class MainWindow(QMainWindow):
                 self.hvdb.include_names = None
             else:
                 self.hvdb.exclude_names = None
-            self.refresh_img_list()
+            self.apply_name_filter()
 
     # ---------------------------------------
     # slots: compare and clear compare
@@ -290,15 +378,15 @@ class MainWindow(QMainWindow):
         key, ok = QFileDialog.getOpenFileName(self, 'Select an image', os.path.join(self.hvdb.get_folder(), '../'))
         if ok:
             self.center_canvas.canvas.add_cmp_folder(key)
+            self.folder_watcher.set_folders(self.hvdb.folder_list)
 
     def clear_compare(self):
         # Compare folder should be set in Main Cavans
         if self.canvas_type != 'main':
             self.switch_main_canvas()
 
-        self.hvdb.folder_list = [self.hvdb.folder_list[0]]
-        self.hvdb.path_list = [self.hvdb.path_list[0]]
-        self.hvdb.fidx = 0
+        self.hvdb.clear_cmp_folders()
+        self.folder_watcher.set_folders(self.hvdb.folder_list)
         # clear the text description in the dock window
         self.center_canvas.canvas.update_path_list()
 
@@ -333,7 +421,8 @@ class MainWindow(QMainWindow):
                     self.hvdb.interval = 1
                     num_view = 1
             else:  # for comparing mode
-                if not self.hvdb.is_same_len:
+                # folders aligned by names show the missing images as placeholders
+                if self.hvdb.is_misaligned():
                     show_msg('Critical', 'Warning', ('Compare folders have different length, \n'
                                                      'It may introduce misalignment and errors.'))
                 self.hvdb.fidx = 0
@@ -376,10 +465,98 @@ class MainWindow(QMainWindow):
     def set_fingerprint(self):
         if self.center_canvas.canvas.show_fingerprint:
             self.center_canvas.canvas.show_fingerprint = False
+            self.fingerprinter.cancel()
         else:
             self.center_canvas.canvas.show_fingerprint = True
         self.center_canvas.canvas.show_image()
 
+    def hash_dialog(self):
+        hash_name, ok = QInputDialog.getItem(self, 'Fingerprint Hash',
+                                             'Content hash (quick: header and sampled blocks):', HASH_NAMES,
+                                             HASH_NAMES.index(self.hvdb.hash_name), False)
+        if ok and hash_name != self.hvdb.hash_name:
+            self.fingerprinter.cancel()
+            self.hvdb.set_hash_name(hash_name)
+            self.center_canvas.canvas.show_image()
+
+    def fingerprint_folders(self):
+        self.fingerprinter.start(self.hvdb.tables, self.hvdb.pidx, self.hvdb.hash_name)
+
+    def set_fingerprints(self, paths, rows, digests, phashes):
+        fidx = self.hvdb.set_fingerprints(paths, rows, digests, phashes)
+        canvas = self.center_canvas.canvas
+        if fidx is None or not getattr(canvas, 'show_fingerprint', False):
+            return
+        # show the fingerprints of the shown images when they are done
+        rows = set(rows)
+        for idx in range(canvas.num_view):
+            _, view_fidx, view_pidx = self.hvdb.get_path(*canvas.get_view_index(idx))
+            if view_fidx == fidx and view_pidx in rows:
+                if canvas.browse_timer.isActive():
+                    # shown when browsing settles
+                    canvas.browse_pending = True
+                else:
+                    canvas.show_image()
+                return
+
+    # ---------------------------------------
+    # slots: near duplicates
+    # ---------------------------------------
+    def near_dup_distance_dialog(self, title):
+        return QInputDialog.getInt(self, title, 'Max Hamming distance of the phashes (0 for copies):',
+                                   self.near_dup_distance, 0, MAX_NEAR_DUP_DISTANCE)
+
+    def group_near_duplicates(self):
+        distance, ok = self.near_dup_distance_dialog('Near Duplicates')
+        if not ok:
+            return
+        self.near_dup_distance = distance
+        num_groups, num_images, num_missing = self.hvdb.group_near_duplicates(distance)
+        msg = f'{num_images} images in {num_groups} near-duplicate groups.'
+        if num_groups > 0:
+            msg += '\nAlt + ← →: browse the images, Alt + ↑ ↓: browse the groups.'
+        self.show_near_dup_msg(msg, num_missing)
+        if num_groups > 0:
+            # the first group
+            self.near_dup_browse(0, by_group=True)
+
+    def find_similar(self):
+        distance, ok = self.near_dup_distance_dialog('Find Similar')
+        if not ok:
+            return
+        self.near_dup_distance = distance
+        num_found, num_missing = self.hvdb.find_similar(distance)
+        msg = f'{num_found} similar images.'
+        if num_found > 0:
+            msg += '\nAlt + ← →: browse the images.'
+        self.show_near_dup_msg(msg, num_missing)
+
+    def show_near_dup_msg(self, msg, num_missing):
+        if num_missing > 0:
+            # the images are fingerprinted in the background, and found when searched again
+            msg += f'\n{num_missing} images are not fingerprinted yet, search again when they are done.'
+            self.fingerprint_folders()
+        show_msg(icon='Information', title='Near Duplicates', text=msg)
+
+    def near_dup_browse(self, step, by_group=False):
+        if self.hvdb.near_dup_browse(step, by_group):
+            self.center_canvas.canvas.show_image()
+
+    def sort_dialog(self):
+        sort_by, ok = QInputDialog.getItem(self, 'Sort', 'Order of the images (similarity: by phash):', SORT_BYS,
+                                           SORT_BYS.index(self.hvdb.sort_by), False)
+        if not ok:
+            return
+        _, img_len_list = self.hvdb.set_sort_by(sort_by)
+        self.center_canvas.canvas.show_updated_list(img_len_list)
+        num_unhashed = self.hvdb.get_num_unhashed(0)
+        if sort_by == 'similarity' and num_unhashed > 0:
+            # sorted again (with Ctrl+S) when they are fingerprinted
+            self.fingerprint_folders()
+            show_msg(icon='Information', title='Sort',
+                     text=f'{num_unhashed} images are not fingerprinted yet, they are put at the end.\n'
+                     'Sort again when they are done.')
+
     # ---------------------------------------
     # slots: auto zoom
     # ---------------------------------------
@@ -394,6 +571,40 @@ class MainWindow(QMainWindow):
             self.center_canvas.canvas.target_zoom_width = int(target_zoom_width)
             self.center_canvas.canvas.show_image(init=False)
 
+    # ---------------------------------------
+    # slots: prefetch
+    # ---------------------------------------
+    def prefetch_dialog(self):
+        prefetcher = self.center_canvas.canvas.prefetcher
+        window, ok = QInputDialog.getText(self, 'Prefetch', '# Images decoded ahead, behind: (e.g., 3, 1)',
+                                          QLineEdit.Normal, f'{prefetcher.num_next}, {prefetcher.num_prev}')
+        if ok:
+            try:
+                num_next, num_prev = [int(v) for v in window.split(',')]
+            except ValueError:
+                show_msg(icon='Warning', title='Warning', text='Prefetch window should be two int.')
+                return
+            prefetcher.num_next = max(num_next, 0)
+            prefetcher.num_prev = max(num_prev, 0)
+            self.center_canvas.canvas.prefetch_neighbours()
+
+    # ---------------------------------------
+    # slots: alignment of compare folders
+    # ---------------------------------------
+    def align_dialog(self):
+        align_by = self.hvdb.align_by if self.hvdb.align_by is not None else 'position'
+        text, ok = QInputDialog.getText(
+            self, 'Compare Alignment', 'Align by (stem, name, position), then stripped suffixes: (e.g., stem, _x4)',
+            QLineEdit.Normal, ', '.join([align_by] + self.hvdb.align_suffixes))
+        if ok:
+            values = [value.strip() for value in text.split(',') if value.strip()]
+            if not values or values[0] not in ('stem', 'name', 'position'):
+                show_msg(icon='Warning', title='Warning', text='Align by should be stem, name or position.')
+                return
+            align_by = None if values[0] == 'position' else values[0]
+            _, img_len_list = self.hvdb.set_alignment(align_by, values[1:])
+            self.center_canvas.canvas.show_updated_list(img_len_list)
+
 
 def create_new_window(init_path=None):
     screen = app.primaryScreen()
@@ -415,6 +626,8 @@ if __name__ == '__main__':
         import ctypes
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID('HandyView')
     print('Welcome to HandyView.')
+    # for the fingerprinting processes of frozen apps
+    multiprocessing.freeze_support()
 
     app = Application(sys.argv)
     app.window_list.append(create_new_window())
@@ -0,0 +1,141 @@
+"""
+A memory-budgeted LRU cache of decoded images, shared by all the canvases.
+"""
+import os
+import threading
+from collections import OrderedDict
+from PyQt5.QtGui import QPixmap
+
+from handyview.utils import sizeof_fmt
+
+# hard budget of decoded bytes kept in the cache
+IMAGE_CACHE_BYTES = 1024 * 1024 * 1024
+
+
+def get_cache_key(path):
+    """Get the cache key of an image file.
+
+    The key contains mtime and size, so that entries of modified files are
+    never hit again (and drop out of the LRU order).
+
+    Returns:
+        tuple | None: (path, mtime, size). None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+class ImageCache():
+    """LRU cache of decoded images, keyed by (path, mtime, size).
+
+    QImage is put by the decoding (worker) threads; the QPixmap is created
+    lazily by the GUI thread and kept together with its QImage, so showing a
+    cached image again does not need any conversion.
+
+    Args:
+        max_bytes (int): Budget in bytes. Default: IMAGE_CACHE_BYTES.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> [QImage, QPixmap | None, num_bytes]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Get the cached QImage and QPixmap (may be None) of a key.
+
+        Returns:
+            tuple | None: (QImage, QPixmap | None), or None for a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def peek(self, path):
+        """Get the most recently used entry of a path, whatever its mtime and decode size.
+
+        It is for placeholders, and does not count as a hit or miss.
+
+        Returns:
+            tuple | None: (key, QImage), or None if the path is not cached.
+        """
+        with self._lock:
+            for key in reversed(self._entries):
+                if key[0] == path:
+                    return key, self._entries[key][0]
+        return None
+
+    def put(self, key, qimg):
+        """Put a decoded QImage. Null images and images over budget are not cached."""
+        if key is None or qimg.isNull():
+            return
+        num_bytes = qimg.sizeInBytes()
+        if num_bytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = [qimg, None, num_bytes]
+            self.num_bytes += num_bytes
+            self._evict()
+
+    def get_pixmap(self, key, qimg):
+        """Get (and cache) the QPixmap of a QImage. Should only be called in the GUI thread."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None:
+                return entry[1]
+        qpixmap = QPixmap.fromImage(qimg)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is None:
+                entry[1] = qpixmap
+                pixmap_bytes = qpixmap.width() * qpixmap.height() * qpixmap.depth() // 8
+                entry[2] += pixmap_bytes
+                self.num_bytes += pixmap_bytes
+                self._evict()
+        return qpixmap
+
+    def _evict(self):
+        # evict the least recently used entries, but always keep the newest one
+        while self.num_bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.num_bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+    def stats(self):
+        return (f'Image cache:\n hit rate: {self.hit_rate * 100:.1f}% ({self.hits}/{self.hits + self.misses})\n'
+                f' {len(self._entries)} images, {sizeof_fmt(self.num_bytes)} / {sizeof_fmt(self.max_bytes)}')
+
+
+# shared by all the canvases
+image_cache = ImageCache()
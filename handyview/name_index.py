@@ -0,0 +1,136 @@
+"""
+Find images by (part of) their names, for going to a file in huge folders.
+
+NameIndex is built lazily in a background thread, over the packed names of a
+PathColumn (case-insensitive):
+
+- a prefix index: the sorted names, searched by bisection.
+- a trigram index: the rows of the names that have each 3-character
+  substring, so that the candidates of a substring query are the
+  intersection of a few short row lists instead of all the names.
+
+Until it is built, queries scan the packed names, which is slower but still
+works.
+"""
+import bisect
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# max number of matches of a query
+SEARCH_LIMIT = 50
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hv_name_index')
+
+
+class NameIndex():
+    """Prefix and trigram index of the names of a PathColumn.
+
+    Args:
+        paths (PathColumn): Paths of the images. The index is valid as long as
+            the PathColumn is not replaced (it is read-only).
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.text = paths.names.lower()
+        self._future = _executor.submit(self._build)
+
+    @property
+    def ready(self):
+        return self._future.done()
+
+    def _build(self):
+        self.names = self.text.split('\n')[:-1]
+        # prefix index
+        order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        self.sorted_names = [self.names[row] for row in order]
+        self.order = np.array(order, dtype=np.int64)
+        # trigram index: the code of each 3-character substring (21 bits a character) that is in a name
+        chars = np.frombuffer(self.text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        lines = np.zeros(len(chars), dtype=np.int64)
+        lines[1:] = np.cumsum(chars[:-1] == 10)
+        codes = (chars[:-2] << np.uint64(42)) | (chars[1:-1] << np.uint64(21)) | chars[2:]
+        valid = (chars[:-2] != 10) & (chars[1:-1] != 10) & (chars[2:] != 10)
+        codes, rows = codes[valid], lines[:-2][valid]
+        # sorted by trigram, then row, without repeated (trigram, row) pairs
+        sort = np.lexsort((rows, codes))
+        codes, rows = codes[sort], rows[sort]
+        keep = np.ones(len(codes), dtype=bool)
+        keep[1:] = (codes[1:] != codes[:-1]) | (rows[1:] != rows[:-1])
+        codes, rows = codes[keep], rows[keep]
+        # the rows of the i-th trigram are postings[bounds[i]:bounds[i + 1]]
+        self.trigrams, starts = np.unique(codes, return_index=True)
+        self.bounds = np.append(starts, len(codes))
+        self.postings = rows
+
+    def get_postings(self, trigram):
+        code = (ord(trigram[0]) << 42) | (ord(trigram[1]) << 21) | ord(trigram[2])
+        idx = np.searchsorted(self.trigrams, np.uint64(code))
+        if idx == len(self.trigrams) or self.trigrams[idx] != code:
+            return self.postings[:0]
+        return self.postings[self.bounds[idx]:self.bounds[idx + 1]]
+
+    def search(self, query, limit=SEARCH_LIMIT, skip=None):
+        """Get the rows of the names that contain query (case-insensitive).
+
+        Names starting with query come first, then the other matches, each in
+        the path list order.
+
+        Args:
+            query (str): Part of the names.
+            limit (int): Max number of matches. Default: SEARCH_LIMIT.
+            skip (np.ndarray): Bool mask of the rows that are not found (e.g.,
+                images moved away), which do not count toward limit. Default: None.
+
+        Returns:
+            list[int]: Rows of the matched names, at most limit.
+        """
+        query = query.lower()
+        if not query or '\n' in query:
+            return []
+        if not self.ready:
+            return self.scan(query, limit, skip)
+        lo = bisect.bisect_left(self.sorted_names, query)
+        hi = bisect.bisect_left(self.sorted_names, query + '\U0010ffff', lo)
+        found = np.sort(self.order[lo:hi])
+        if skip is not None:
+            found = found[~skip[found]]
+        found = found[:limit].tolist()
+        if len(found) >= limit:
+            return found
+        if len(query) < 3:
+            # short queries match a lot of names, which are found quickly by the scan
+            matched = self.scan(query, limit + len(found), skip)
+        else:
+            postings = sorted((self.get_postings(query[idx:idx + 3]) for idx in range(len(query) - 2)), key=len)
+            candidates = postings[0]
+            for rows in postings[1:]:
+                # a few candidates are verified faster than intersected with long lists
+                if len(rows) > 8 * len(candidates):
+                    break
+                candidates = np.intersect1d(candidates, rows, assume_unique=True)
+            # the candidates are verified (lazily), since the trigrams may not be in a row
+            matched = (row for start in range(0, len(candidates), 256) for row in candidates[start:start + 256].tolist()
+                       if query in self.names[row] and (skip is None or not skip[row]))
+        prefixed = set(found)
+        for row in matched:
+            if row not in prefixed:
+                found.append(row)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def scan(self, query, limit=SEARCH_LIMIT, skip=None):
+        """Get the rows of the names that contain query, by scanning all the names (see search)."""
+        found = []
+        row = 0
+        start = 0
+        pos = self.text.find(query)
+        while pos >= 0 and len(found) < limit:
+            row += self.text.count('\n', start, pos)
+            if skip is None or not skip[row]:
+                found.append(row)
+            # continue from the next name
+            start = self.text.find('\n', pos)
+            pos = self.text.find(query, start + 1)
+        return found
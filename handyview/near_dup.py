@@ -0,0 +1,211 @@
+"""
+Find near-duplicate images by the Hamming distance of their 64-bit phashes.
+
+PhashIndex is a multi-index hash: the phashes are split into NUM_CHUNKS
+chunks of 16 bits, and each chunk is indexed by a bucket table (the phashes
+sorted by the chunk, and where each chunk value starts). By the pigeonhole
+principle, two phashes within distance d have (at least) one chunk within
+distance d // NUM_CHUNKS, so the candidates of a query are found by looking
+up the chunks of the query with up to d // NUM_CHUNKS bits flipped, instead
+of comparing against all the phashes. The candidates are then verified by
+their full distances.
+
+The lookups are vectorized by numpy, for a single query (search), and for all
+the phashes at once (group).
+"""
+import numpy as np
+from itertools import combinations
+
+NUM_CHUNKS = 4
+CHUNK_BITS = 64 // NUM_CHUNKS
+# default max Hamming distance of near-duplicates
+NEAR_DUP_DISTANCE = 6
+# lookups of larger distances flip more bits of the chunks, e.g., grouping 100k images within 10 takes seconds
+MAX_NEAR_DUP_DISTANCE = 10
+# the nearest-neighbour chain is quadratic, larger groups are chained in blocks (see get_chain)
+CHAIN_BLOCK = 2048
+
+if hasattr(np, 'bitwise_count'):
+
+    def popcount(values):
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT8 = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        return _POPCOUNT8[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8).reshape(values.shape)
+
+
+def get_flip_masks(max_bits):
+    """Masks of a chunk with up to max_bits bits set (0 included)."""
+    masks = [0]
+    for num_bits in range(1, min(max_bits, CHUNK_BITS) + 1):
+        masks.extend(sum(1 << bit for bit in bits) for bits in combinations(range(CHUNK_BITS), num_bits))
+    return np.array(masks, dtype=np.uint64)
+
+
+def gather_ranges(values, starts, ends):
+    """Concatenate values[starts[i]:ends[i]] for all i (without a Python loop)."""
+    counts = ends - starts
+    total = int(counts.sum())
+    if total == 0:
+        return values[:0], counts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return values[offsets + np.arange(total)], counts
+
+
+class PhashIndex():
+    """Multi-index hash of phashes, see the module docstring.
+
+    Args:
+        phashes (np.ndarray): 64-bit phashes (uint64).
+    """
+
+    def __init__(self, phashes):
+        self.phashes = np.asarray(phashes, dtype=np.uint64)
+        # (bounds, order) of each chunk: the phashes whose chunk is v are order[bounds[v]:bounds[v + 1]]
+        self.chunks = []
+        for idx in range(NUM_CHUNKS):
+            keys = self.get_chunk(self.phashes, idx).astype(np.int64)
+            bounds = np.zeros((1 << CHUNK_BITS) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=1 << CHUNK_BITS), out=bounds[1:])
+            self.chunks.append((bounds, np.argsort(keys, kind='stable')))
+
+    def __len__(self):
+        return len(self.phashes)
+
+    @staticmethod
+    def get_chunk(phashes, idx):
+        return (phashes >> np.uint64(idx * CHUNK_BITS)) & np.uint64((1 << CHUNK_BITS) - 1)
+
+    def search(self, phash, distance=NEAR_DUP_DISTANCE):
+        """Find the phashes within a Hamming distance of phash.
+
+        Returns:
+            tuple[np.ndarray]: Indices of the found phashes, and their distances,
+                sorted by the distances.
+        """
+        phash = np.uint64(phash)
+        masks = get_flip_masks(distance // NUM_CHUNKS)
+        candidates = []
+        for idx, (bounds, order) in enumerate(self.chunks):
+            probes = (self.get_chunk(phash, idx) ^ masks).astype(np.int64)
+            found, _ = gather_ranges(order, bounds[probes], bounds[probes + 1])
+            candidates.append(found)
+        candidates = np.unique(np.concatenate(candidates))
+        distances = popcount(self.phashes[candidates] ^ phash)
+        keep = distances <= distance
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def get_pairs(self, distance=NEAR_DUP_DISTANCE):
+        """Get all the pairs (i < j) of phashes within a Hamming distance.
+
+        Returns:
+            tuple[np.ndarray]: i and j of the pairs. A pair may be repeated.
+        """
+        masks = get_flip_masks(distance // NUM_CHUNKS)
+        num = len(self.phashes)
+        pairs_i, pairs_j = [], []
+        for idx, (bounds, order) in enumerate(self.chunks):
+            chunk = self.get_chunk(self.phashes, idx)
+            for mask in masks:
+                probes = (chunk ^ mask).astype(np.int64)
+                found, counts = gather_ranges(order, bounds[probes], bounds[probes + 1])
+                rows = np.repeat(np.arange(num), counts)
+                keep = rows < found
+                rows, found = rows[keep], found[keep]
+                keep = popcount(self.phashes[rows] ^ self.phashes[found]) <= distance
+                pairs_i.append(rows[keep])
+                pairs_j.append(found[keep])
+        return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+    def group(self, distance=NEAR_DUP_DISTANCE):
+        """Group the phashes into near-duplicates (connected by distances within distance).
+
+        Returns:
+            list[np.ndarray]: Indices of each group (of two or more phashes), in
+                the index order. The groups are sorted by their first indices.
+        """
+        # identical phashes (e.g., copies) are grouped first, so they are looked up once.
+        # the pairs and the labels are of the (sorted) unique phashes, which are mapped back by inverse
+        unique, inverse = np.unique(self.phashes, return_inverse=True)
+        pairs_i, pairs_j = PhashIndex(unique).get_pairs(distance)
+        # connected components: the root (min label) of each pair is hooked to the smaller root,
+        # then the labels jump to their roots, so long chains (e.g., bursts) are joined in a few rounds
+        labels = np.arange(len(unique))
+        while len(pairs_i) > 0:
+            roots_i, roots_j = labels[pairs_i], labels[pairs_j]
+            joined = roots_i != roots_j
+            pairs_i, pairs_j = pairs_i[joined], pairs_j[joined]
+            roots_i, roots_j = roots_i[joined], roots_j[joined]
+            np.minimum.at(labels, np.maximum(roots_i, roots_j), np.minimum(roots_i, roots_j))
+            while True:
+                jumped = labels[labels]
+                if np.array_equal(jumped, labels):
+                    break
+                labels = jumped
+        labels = labels[inverse.reshape(-1)]
+        order = np.argsort(labels, kind='stable')
+        starts = np.flatnonzero(np.diff(labels[order], prepend=-1))
+        groups = [group for group in np.split(order, starts[1:]) if len(group) > 1]
+        groups.sort(key=lambda group: group[0])
+        return groups
+
+
+def get_chain(phashes):
+    """Order phashes as a greedy nearest-neighbour chain, from the first one.
+
+    More than CHAIN_BLOCK phashes are sorted first, and each block of them
+    (sharing the high bits) is chained.
+
+    Returns:
+        np.ndarray: Indices of the phashes in the chain order.
+    """
+    num = len(phashes)
+    if num <= 2:
+        return np.arange(num)
+    if num > CHAIN_BLOCK:
+        order = np.argsort(phashes, kind='stable')
+        return np.concatenate([
+            order[start:start + CHAIN_BLOCK][get_chain(phashes[order[start:start + CHAIN_BLOCK]])]
+            for start in range(0, num, CHAIN_BLOCK)
+        ])
+    chain = np.zeros(num, dtype=np.int64)
+    distances = np.zeros(num, dtype=np.int64)
+    # the visited ones are never the nearest
+    visited = np.zeros(num, dtype=bool)
+    visited[0] = True
+    for step in range(1, num):
+        distances[:] = popcount(phashes ^ phashes[chain[step - 1]])
+        distances[visited] = 65
+        chain[step] = np.argmin(distances)
+        visited[chain[step]] = True
+    return chain
+
+
+def similarity_order(phashes, distance=NEAR_DUP_DISTANCE):
+    """Order phashes so that similar ones are next to each other.
+
+    The near-duplicates (see PhashIndex.group) are kept together, in a greedy
+    nearest-neighbour chain from their first phash. The groups and the other
+    phashes are sorted by their (first) phashes, so the ones that share the high
+    bits, i.e., the signs of the lowest frequencies, are close.
+
+    Returns:
+        np.ndarray: Indices of the phashes in the similarity order.
+    """
+    phashes = np.asarray(phashes, dtype=np.uint64)
+    num = len(phashes)
+    # each phash is sorted by the head (first phash) of its group, then its position in the chain
+    heads = np.arange(num)
+    positions = np.zeros(num, dtype=np.int64)
+    for group in PhashIndex(phashes).group(distance):
+        heads[group] = group[0]
+        positions[group[get_chain(phashes[group])]] = np.arange(len(group))
+    head_rows = np.flatnonzero(heads == np.arange(num))
+    ranks = np.zeros(num, dtype=np.int64)
+    ranks[head_rows[np.argsort(phashes[head_rows], kind='stable')]] = np.arange(len(head_rows))
+    return np.lexsort((positions, ranks[heads]))
@@ -0,0 +1,232 @@
+"""
+Decode images on worker threads, so that browsing only needs to swap in an
+already-decoded image.
+
+QImage (unlike QPixmap) can be created outside the GUI thread, so workers
+decode to QImage and put it into the shared image cache. The canvas converts
+it to QPixmap when showing it.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImageReader
+
+from handyview.image_cache import get_cache_key, image_cache
+from handyview.tiles import TILED_MIN_PIXELS
+
+# number of images decoded ahead of / behind the current one (in the browsing direction)
+PREFETCH_NEXT = 3
+PREFETCH_PREV = 1
+PREFETCH_WORKERS = 2
+# decode large images at (about) screen resolution first, see Prefetcher.get_decode_size
+REDUCED_DECODE = True
+
+
+def load_qimage(path, size=None):
+    """Decode an image file to QImage.
+
+    Args:
+        path (str): Image path.
+        size (QSize): If given, decode the image scaled to this size. For JPEG,
+            it uses the scaled (DCT) decoding of libjpeg, which is much faster
+            than decoding all the pixels. Default: None.
+
+    Returns:
+        QImage: Decoded image. It is null if the file cannot be read (e.g., it
+            has been moved to a sub-folder).
+    """
+    reader = QImageReader(path)
+    if size is not None:
+        reader.setScaledSize(size)
+    return reader.read()
+
+
+def get_reduced_key(key, size):
+    """Cache key of a reduced decode. The key of a full decode is not changed."""
+    if key is None or size is None:
+        return key
+    return key + (size.width(), size.height())
+
+
+class Prefetcher():
+    """Decode the neighbouring images of the current one in the background.
+
+    Args:
+        num_next (int): Number of images decoded ahead of the current one.
+            Default: PREFETCH_NEXT.
+        num_prev (int): Number of images decoded behind the current one.
+            Default: PREFETCH_PREV.
+        num_workers (int): Number of worker threads. Default: PREFETCH_WORKERS.
+        num_shown (int): Number of images shown together (views of the
+            canvas), which are decoded concurrently by get_all. Default: 1.
+        cache (ImageCache): Where the decoded images are put. Default: the
+            shared image_cache.
+    """
+
+    def __init__(self,
+                 num_next=PREFETCH_NEXT,
+                 num_prev=PREFETCH_PREV,
+                 num_workers=PREFETCH_WORKERS,
+                 num_shown=1,
+                 cache=None):
+        self.num_next = num_next
+        self.num_prev = num_prev
+        self.cache = image_cache if cache is None else cache
+        # max size of reduced decodes (usually the screen size). None for always decoding at full resolution.
+        self.max_size = None
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='hv_prefetch')
+        # the shown images do not queue behind the prefetching
+        self._shown_executor = None
+        if num_shown > 1:
+            self._shown_executor = ThreadPoolExecutor(max_workers=num_shown, thread_name_prefix='hv_shown')
+        # (path, zoom) -> Future of the decode (the result is in the cache).
+        # zoom is None for full-resolution decodes.
+        self._futures = {}
+
+    def get_decode_size(self, width, height, zoom=1):
+        """Get the size to decode an image at.
+
+        Images larger than max_size are decoded reduced to fit max_size, unless
+        they are shown at a zoom ratio where the reduced image would be
+        upscaled (past 1:1 of the reduced image).
+
+        Args:
+            width (int): Image width.
+            height (int): Image height.
+            zoom (float): Zoom ratio of the view. Default: 1.
+
+        Returns:
+            QSize | None: The reduced size. None for decoding at full resolution.
+        """
+        if self.max_size is None or (width <= self.max_size.width() and height <= self.max_size.height()):
+            return None
+        size = QSize(width, height).scaled(self.max_size, QtCore.Qt.KeepAspectRatio)
+        if zoom * width > size.width():
+            return None
+        return size
+
+    def _load(self, path, zoom):
+        key = get_cache_key(path)
+        if key is None:
+            return
+        reader = QImageReader(path)
+        size = reader.size()  # only reads the header
+        if (path, zoom) not in self._futures:
+            # dropped from the window (e.g., skipped in a browsing burst) after it has started
+            return
+        if size.width() * size.height() >= TILED_MIN_PIXELS:
+            # rendered by tiles, see TiledImageItem
+            return
+        if zoom is not None and size.isValid():
+            decode_size = self.get_decode_size(size.width(), size.height(), zoom)
+            key = get_reduced_key(key, decode_size)
+            if decode_size is not None:
+                reader.setScaledSize(decode_size)
+        if key not in self.cache:
+            self.cache.put(key, reader.read())
+
+    def get_offsets(self, step, stride=1):
+        """Get the pidx offsets that should be prefetched after a browsing step.
+
+        Args:
+            step (int): The last browsing step, e.g., 1, -1, 10, -10.
+            stride (int): Number of pidx moved by a step of 1 (interval + 1).
+
+        Returns:
+            list[int]: Offsets (relative to the current pidx), nearest first.
+        """
+        direction = -1 if step < 0 else 1
+        offsets = []
+        for k in range(1, self.num_next + 1):
+            offsets.append(direction * k * stride)
+        for k in range(1, self.num_prev + 1):
+            offsets.append(-direction * k * stride)
+        # Shift strides (e.g., ±10): also decode the images that the next strides reach
+        if abs(step) > 1:
+            for k in range(1, self.num_next + 1):
+                offsets.append(k * step * stride)
+        return offsets
+
+    def prefetch(self, paths, zoom=1):
+        """Start decoding the given paths and drop the ones out of the window.
+
+        Args:
+            paths (list[str]): Paths in the prefetch window, nearest first. The
+                currently shown paths should also be included, so that they are
+                kept.
+            zoom (float): Zoom ratio of the views, to decide reduced decoding.
+                Default: 1.
+        """
+        window = set(paths)
+        for path_zoom in list(self._futures):
+            # drop the decodes out of the window, or with an outdated zoom ratio
+            if path_zoom[0] not in window or path_zoom[1] not in (zoom, None):
+                # cancel() is a no-op for decodes that have already started
+                self._futures.pop(path_zoom).cancel()
+        for path in paths:
+            if (path, zoom) not in self._futures:
+                self._futures[(path, zoom)] = self._executor.submit(self._load, path, zoom)
+
+    def prefetch_full(self, path):
+        """Start decoding an image at full resolution, e.g., when zooming in on its reduced decode.
+
+        Returns:
+            Future: The decode (the result is in the cache).
+        """
+        if (path, None) not in self._futures:
+            self._futures[(path, None)] = self._executor.submit(self._load, path, None)
+        return self._futures[(path, None)]
+
+    def get(self, path, key=None, size=None, zoom=1):
+        """Get the decoded image of a path.
+
+        It waits for the prefetched decode if there is one in flight, then
+        looks up the cache, and decodes the image in the current thread for a
+        miss.
+
+        Args:
+            path (str): Image path.
+            key (tuple): Cache key, e.g., from ImageInfo.cache_key. If None, it
+                is got by a stat of the path. Default: None.
+            size (QSize): Size of a reduced decode, from get_decode_size. None
+                for the full resolution. Default: None.
+            zoom (float): Zoom ratio that size is got with. Prefetched decodes
+                with other zoom ratios are not waited for. Default: 1.
+
+        Returns:
+            tuple: (cache key, QImage). The key is None for missing files.
+        """
+        # a reduced decode does not wait for the full resolution being decoded
+        for future_zoom in ((zoom, ) if size is not None else (zoom, None)):
+            future = self._futures.get((path, future_zoom))
+            if future is not None and not future.cancelled():
+                future.result()
+        if key is None:
+            key = get_cache_key(path)
+        key = get_reduced_key(key, size)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return key, cached[0]
+        qimg = load_qimage(path, size)
+        self.cache.put(key, qimg)
+        return key, qimg
+
+    def get_all(self, requests):
+        """Get the decoded images of the views of a canvas concurrently.
+
+        Args:
+            requests (list[tuple]): Arguments (path, key, size, zoom) of get for
+                each image.
+
+        Returns:
+            list[tuple]: (cache key, QImage) for each request, in order.
+        """
+        if self._shown_executor is None or len(requests) <= 1:
+            return [self.get(*request) for request in requests]
+        futures = [self._shown_executor.submit(self.get, *request) for request in requests]
+        return [future.result() for future in futures]
+
+    def clear(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
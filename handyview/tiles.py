@@ -0,0 +1,382 @@
+"""
+Tiled, multi-resolution rendering for huge (e.g., gigapixel) images.
+
+The image is split into a pyramid of tiles: level 0 is the full resolution,
+and each level above halves the resolution, until the whole image fits in one
+tile. A TiledImageItem only decodes (and keeps) the tiles of the level of
+detail that the view transform needs, and only those in the exposed area.
+
+Tiles are decoded with QImageReader clip rects, which JPEG supports natively.
+Other formats (e.g., PNG and TIFF) can only be decoded fully, so the pyramid
+of such an image is built once in TILE_CACHE_DIR (see write_pyramid), and the
+tiles are read from there. The tiles of JPEG can be persisted as well, and
+re-opening the image then only reads the small tile files. TILE_CACHE_DIR is
+kept under TILE_CACHE_BYTES, see prune_tile_cache.
+"""
+import hashlib
+import math
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore
+from PyQt5.QtCore import QRect, QRectF, QSize, Qt
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader, QPainter
+from PyQt5.QtWidgets import QGraphicsObject, QGraphicsItem, QStyleOptionGraphicsItem
+
+from handyview.image_cache import ImageCache
+from handyview.utils import CACHE_DIR
+
+# images with more pixels are rendered by tiles
+TILED_MIN_PIXELS = 200 * 1000 * 1000
+TILE_SIZE = 512
+TILE_WORKERS = 2
+# persist the tile pyramids in TILE_CACHE_DIR
+TILE_PERSIST = True
+TILE_CACHE_DIR = os.path.join(CACHE_DIR, 'tiles')
+# TILE_CACHE_DIR is pruned to this size, the least recently used pyramids first
+TILE_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+# images without region decode are decoded reduced to at most this many pixels to build their
+# pyramids (Qt5 cannot allocate images of over 2 GB), and their finer levels are not shown
+TILE_DECODE_MAX_PIXELS = 256 * 1024 * 1024
+# written in a tile dir when its pyramid is complete, see write_pyramid
+PYRAMID_DONE = 'done'
+# quality of the saved tiles (PNG), a lower compression is several times faster to write
+TILE_PNG_QUALITY = 80
+
+# decoded tiles of all the tiled images, keyed by (path, mtime, size, level, tx, ty)
+tile_cache = ImageCache(max_bytes=256 * 1024 * 1024)
+# keys of the tiles that failed to decode, which are not decoded again
+failed_tiles = set()
+# tile dirs whose pyramids failed to build, which are not built again
+failed_pyramids = set()
+# pyramids are built one at a time, each needs a decode of a whole image
+_pyramid_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix='hv_tiles')
+
+
+def read_tile(path, width, height, level, tx, ty, tile_size=TILE_SIZE):
+    """Decode one tile of the pyramid from the image file.
+
+    Args:
+        path (str): Image path.
+        width (int): Image width (of level 0).
+        height (int): Image height (of level 0).
+        level (int): Pyramid level. The resolution of level l is 1 / 2^l.
+        tx (int): Tile column.
+        ty (int): Tile row.
+        tile_size (int): Tile size. Default: TILE_SIZE.
+
+    Returns:
+        QImage: The tile. Tiles on the right and bottom borders may be smaller
+            than tile_size.
+    """
+    level_w, level_h = math.ceil(width / 2**level), math.ceil(height / 2**level)
+    rect = QRect(tx * tile_size, ty * tile_size, tile_size, tile_size).intersected(QRect(0, 0, level_w, level_h))
+    reader = QImageReader(path)
+    if level == 0:
+        reader.setClipRect(rect)
+    else:
+        reader.setScaledSize(QSize(level_w, level_h))
+        reader.setScaledClipRect(rect)
+    return reader.read()
+
+
+def supports_region_decode(path):
+    """Whether the format of an image decodes a clip rect without decoding the whole image (e.g., JPEG)."""
+    return QImageReader(path).supportsOption(QImageIOHandler.ClipRect)
+
+
+def get_min_level(width, height, max_pixels=TILE_DECODE_MAX_PIXELS):
+    """The finest level of the pyramid that has at most max_pixels, i.e., that can be decoded at once."""
+    level = 0
+    while math.ceil(width / 2**level) * math.ceil(height / 2**level) > max_pixels:
+        level += 1
+    return level
+
+
+def save_tile(qimg, tile_path):
+    # write to a temporary file first, so that a partial tile is never read
+    tmp_path = f'{tile_path}.{os.getpid()}.tmp'
+    if qimg.save(tmp_path, 'PNG', TILE_PNG_QUALITY):
+        os.replace(tmp_path, tile_path)
+
+
+def write_pyramid(path, tile_dir, width, height, min_level, max_level, tile_size=TILE_SIZE, tile_written=None):
+    """Build the pyramid of an image without region decode in tile_dir, from a single decode.
+
+    The image is decoded at min_level (see get_min_level) and halved for the
+    coarser levels, which take a third more memory. The levels are written as
+    tiles from the top level on, and each level is freed once it is written.
+
+    Args:
+        path (str): Image path.
+        tile_dir (str): Where the tiles are written, as {level}_{tx}_{ty}.png.
+        width (int): Image width (of level 0).
+        height (int): Image height (of level 0).
+        min_level (int): The finest level.
+        max_level (int): The top level, which fits in one tile.
+        tile_size (int): Tile size. Default: TILE_SIZE.
+        tile_written (callable): Called with (level, tx, ty) after each tile
+            is written, e.g., to show it before the finer levels are written.
+            Default: None.
+
+    Returns:
+        bool: Whether the pyramid is built. False if the image fails to decode.
+    """
+    done_path = os.path.join(tile_dir, PYRAMID_DONE)
+    if os.path.exists(done_path):
+        return True
+    reader = QImageReader(path)
+    if min_level > 0:
+        reader.setScaledSize(QSize(math.ceil(width / 2**min_level), math.ceil(height / 2**min_level)))
+    qimg = reader.read()
+    if qimg.isNull():
+        return False
+    levels = [qimg]
+    for _ in range(min_level, max_level):
+        # the same size as read_tile, i.e., ceil(width / 2^level)
+        levels.append(levels[-1].scaled((levels[-1].width() + 1) // 2, (levels[-1].height() + 1) // 2,
+                                        Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+    del qimg
+    os.makedirs(tile_dir, exist_ok=True)
+    for level in range(max_level, min_level - 1, -1):
+        level_img = levels.pop()
+        for ty in range(math.ceil(level_img.height() / tile_size)):
+            for tx in range(math.ceil(level_img.width() / tile_size)):
+                rect = QRect(tx * tile_size, ty * tile_size, tile_size, tile_size).intersected(level_img.rect())
+                save_tile(level_img.copy(rect), os.path.join(tile_dir, f'{level}_{tx}_{ty}.png'))
+                if tile_written is not None:
+                    tile_written(level, tx, ty)
+    open(done_path, 'w').close()
+    return True
+
+
+def prune_tile_cache(max_bytes=TILE_CACHE_BYTES, keep=None):
+    """Remove the least recently used pyramids in TILE_CACHE_DIR, until it is at most max_bytes.
+
+    The tile dirs are ordered by their mtime, which is updated when a tile is
+    written in them, or when they are shown (see TiledImageItem.load_overview).
+
+    Args:
+        max_bytes (int): Size limit. Default: TILE_CACHE_BYTES.
+        keep (str): A tile dir being used, which is not removed. Default: None.
+    """
+    pyramids = []
+    try:
+        with os.scandir(TILE_CACHE_DIR) as entries:
+            tile_dirs = [entry.path for entry in entries if entry.is_dir()]
+    except OSError:
+        return
+    for tile_dir in tile_dirs:
+        try:
+            with os.scandir(tile_dir) as entries:
+                num_bytes = sum(entry.stat().st_size for entry in entries)
+            pyramids.append((os.stat(tile_dir).st_mtime, num_bytes, tile_dir))
+        except OSError:
+            # removed meanwhile
+            continue
+    total_bytes = sum(num_bytes for _, num_bytes, _ in pyramids)
+    for _, num_bytes, tile_dir in sorted(pyramids):
+        if total_bytes <= max_bytes:
+            break
+        if tile_dir != keep:
+            shutil.rmtree(tile_dir, ignore_errors=True)
+            total_bytes -= num_bytes
+
+
+class TiledImageItem(QGraphicsObject):
+    """A QGraphicsItem that renders a huge image by tiles.
+
+    Its coordinates are the full resolution, the same as QGraphicsPixmapItem
+    of the whole image.
+
+    Args:
+        path (str): Image path.
+        key (tuple): Cache key of the image (path, mtime, size), e.g., from
+            ImageInfo.cache_key.
+        width (int): Image width.
+        height (int): Image height.
+        persist (bool): Whether to persist the tiles of formats with region
+            decode (e.g., JPEG) in TILE_CACHE_DIR. The pyramids of the other
+            formats are always built there. Default: TILE_PERSIST.
+        tile_size (int): Tile size. Default: TILE_SIZE.
+    """
+    tile_ready = QtCore.pyqtSignal(int, int, int)
+    overview_ready = QtCore.pyqtSignal(QImage)
+
+    def __init__(self, path, key, width, height, persist=TILE_PERSIST, tile_size=TILE_SIZE, parent=None):
+        super(TiledImageItem, self).__init__(parent)
+        self.path = path
+        self.key = key
+        self.width = width
+        self.height = height
+        self.persist = persist
+        self.tile_size = tile_size
+        # the top level fits in one tile
+        self.max_level = max(math.ceil(math.log2(max(width, height) / tile_size)), 0)
+        self.tile_dir = os.path.join(TILE_CACHE_DIR, hashlib.sha1(repr(key).encode()).hexdigest())
+        # formats without region decode are decoded once to build the pyramid, see write_pyramid.
+        # the levels finer than min_level are not built for images that are too large to decode at once
+        self.region_decode = supports_region_decode(path)
+        self.min_level = 0 if self.region_decode else min(get_min_level(width, height), self.max_level)
+        # (level, tx, ty) -> Future
+        self._pending = {}
+
+        # exposedRect is only filled with the extended style option
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.tile_ready.connect(self.on_tile_ready)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    def load_overview(self):
+        """Load the top level (the whole image in one tile) in the background, e.g., for picking colors.
+
+        overview_ready(qimg) is emitted in the GUI thread when it is loaded.
+        """
+        _executor.submit(self._load_overview_async)
+
+    def get_level(self, painter):
+        """The coarsest level whose resolution is not lower than the screen."""
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        if lod <= 0:
+            return self.max_level
+        return min(max(int(math.floor(math.log2(1 / lod))), self.min_level), self.max_level)
+
+    def get_tile_rect(self, level, tx, ty):
+        """Rect of a tile in the item (full resolution) coordinates."""
+        span = self.tile_size * 2**level
+        return QRectF(tx * span, ty * span, span, span).intersected(self.boundingRect())
+
+    def load_tile(self, level, tx, ty):
+        """Load a tile from the memory cache, the disk cache, or the image file (in that order)."""
+        key = self.key + (level, tx, ty)
+        cached = tile_cache.get(key)
+        if cached is not None:
+            return cached[0]
+        if key in failed_tiles:
+            return QImage()
+        tile_path = os.path.join(self.tile_dir, f'{level}_{tx}_{ty}.png')
+        qimg = QImage()
+        if (self.persist or not self.region_decode) and os.path.exists(tile_path):
+            qimg = QImage(tile_path)
+        if qimg.isNull() and self.region_decode:
+            qimg = read_tile(self.path, self.width, self.height, level, tx, ty, self.tile_size)
+            if self.persist and not qimg.isNull():
+                self.make_tile_dir()
+                save_tile(qimg, tile_path)
+        elif qimg.isNull() and self.build_pyramid() and os.path.exists(tile_path):
+            qimg = QImage(tile_path)
+        if qimg.isNull():
+            failed_tiles.add(key)
+        tile_cache.put(key, qimg)
+        return qimg
+
+    def make_tile_dir(self):
+        if not os.path.isdir(self.tile_dir):
+            os.makedirs(self.tile_dir, exist_ok=True)
+            # a new pyramid in the disk cache
+            prune_tile_cache(keep=self.tile_dir)
+
+    def build_pyramid(self):
+        """Build the pyramid of an image without region decode once, see write_pyramid."""
+        with _pyramid_lock:
+            if self.tile_dir in failed_pyramids:
+                return False
+            is_new = not os.path.isdir(self.tile_dir)
+            try:
+                built = write_pyramid(self.path, self.tile_dir, self.width, self.height, self.min_level,
+                                      self.max_level, self.tile_size, self.on_tile_written)
+            except OSError:
+                built = False
+            if not built:
+                failed_pyramids.add(self.tile_dir)
+            elif is_new:
+                prune_tile_cache(keep=self.tile_dir)
+            return built
+
+    def on_tile_written(self, level, tx, ty):
+        # called while the pyramid is being built (in a tile worker)
+        try:
+            if (level, tx, ty) == (self.max_level, 0, 0):
+                self.overview_ready.emit(self.load_tile(level, tx, ty))
+            self.tile_ready.emit(level, tx, ty)
+        except RuntimeError:
+            # the item has been removed from the scene (and deleted)
+            pass
+
+    def _load_overview_async(self):
+        try:
+            # the pyramid is used recently, see prune_tile_cache
+            os.utime(self.tile_dir)
+        except OSError:
+            pass
+        qimg = self.load_tile(self.max_level, 0, 0)
+        try:
+            self.overview_ready.emit(qimg)
+            self.tile_ready.emit(self.max_level, 0, 0)
+        except RuntimeError:
+            # the item has been removed from the scene (and deleted)
+            pass
+
+    def _load_tile_async(self, level, tx, ty):
+        self.load_tile(level, tx, ty)
+        try:
+            self.tile_ready.emit(level, tx, ty)
+        except RuntimeError:
+            # the item has been removed from the scene (and deleted)
+            pass
+
+    def on_tile_ready(self, level, tx, ty):
+        self._pending.pop((level, tx, ty), None)
+        self.update(self.get_tile_rect(level, tx, ty))
+
+    def get_cached_pixmap(self, level, tx, ty):
+        key = self.key + (level, tx, ty)
+        cached = tile_cache.get(key)
+        if cached is None:
+            return None
+        return tile_cache.get_pixmap(key, cached[0])
+
+    def paint(self, painter, option, widget=None):
+        level = self.get_level(painter)
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        span = self.tile_size * 2**level
+        tx_start, tx_end = int(exposed.left() // span), int(math.ceil(exposed.right() / span))
+        ty_start, ty_end = int(exposed.top() // span), int(math.ceil(exposed.bottom() / span))
+        visible = set()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        for ty in range(ty_start, ty_end):
+            for tx in range(tx_start, tx_end):
+                visible.add((level, tx, ty))
+                if not self.paint_tile(painter, level, tx, ty):
+                    if (level, tx, ty) not in self._pending and self.key + (level, tx, ty) not in failed_tiles:
+                        self._pending[(level, tx, ty)] = _executor.submit(self._load_tile_async, level, tx, ty)
+                    # a coarser tile is shown until the tile is decoded
+                    self.paint_coarser_tile(painter, level, tx, ty)
+        # tiles scrolled out of the view are not decoded anymore
+        for tile_id in list(self._pending):
+            if tile_id not in visible and self._pending[tile_id].cancel():
+                self._pending.pop(tile_id)
+
+    def paint_tile(self, painter, level, tx, ty, target=None):
+        """Paint a cached tile (or its part overlapping target). Return False if it is not cached."""
+        qpixmap = self.get_cached_pixmap(level, tx, ty)
+        if qpixmap is None:
+            return False
+        tile_rect = self.get_tile_rect(level, tx, ty)
+        if target is None:
+            target = tile_rect
+        scale = 2**level
+        source = QRectF((target.left() - tile_rect.left()) / scale, (target.top() - tile_rect.top()) / scale,
+                        target.width() / scale, target.height() / scale)
+        painter.drawPixmap(target, qpixmap, source)
+        return True
+
+    def paint_coarser_tile(self, painter, level, tx, ty):
+        target = self.get_tile_rect(level, tx, ty)
+        for coarse_level in range(level + 1, self.max_level + 1):
+            shift = coarse_level - level
+            if self.paint_tile(painter, coarse_level, tx >> shift, ty >> shift, target):
+                return
@@ -1,6 +1,9 @@
 import os
 import re
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatchcase
 from PIL import Image, ImageDraw
 
 FORMATS = ('.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG', '.ppm', '.PPM', '.bmp', '.BMP', '.gif', '.GIF', '.tiff',
@@ -14,6 +17,15 @@ if getattr(sys, 'frozen', False):
 else:
     ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# number of directories listed concurrently by scandir_parallel
+SCAN_WORKERS = 16
+# glob patterns of the directory names that recursive scans do not descend into.
+# by default, the sub-folders that the images are moved (sorted) to, see canvas.move_image_to_subdir
+SCAN_IGNORE = ('_deleted', '_[A-Z]')
+
+# for caches persisted across sessions, e.g., tile pyramids of huge images
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'handyview')
+
 
 def sizeof_fmt(size, suffix='B'):
     """Get human readable file size.
@@ -72,10 +84,88 @@ def scandir(dir_path, suffix=None, recursive=False, full_path=False):
     return _scandir(dir_path, suffix=suffix, recursive=recursive)
 
 
+def scandir_parallel(dir_path, suffix=None, ignore=SCAN_IGNORE, num_workers=SCAN_WORKERS):
+    """Recursively scan a directory, listing the subdirectories concurrently.
+
+    On network filesystems (NFS, SMB), a scan is dominated by the round trip
+    of listing each directory, so the subdirectories are listed in parallel by
+    a thread pool. The file types come from the DirEntry of the listing, with
+    no extra stat call for each entry.
+
+    Subdirectories matching the ignore patterns are pruned before descending.
+    Each directory is listed once, even if symlinks lead to it again, so
+    symlink loops do not make the walk endless.
+
+    Args:
+        dir_path (str): Path of the directory.
+        suffix (str | tuple(str), optional): File suffix that we are
+            interested in. Default: None.
+        ignore (tuple(str)): Glob patterns of the directory names that are
+            not descended into. Default: SCAN_IGNORE.
+        num_workers (int): Number of directories listed concurrently.
+            Default: SCAN_WORKERS.
+
+    Returns:
+        list[str]: Full paths of the interested files, naturally sorted.
+    """
+    if (suffix is not None) and not isinstance(suffix, (str, tuple)):
+        raise TypeError('"suffix" must be a string or tuple of strings')
+
+    # (st_dev, st_ino) of the listed directories
+    visited = set()
+    visited_lock = threading.Lock()
+
+    def _list_dir(path):
+        files, subdirs = [], []
+        try:
+            stat = os.stat(path)
+            # st_ino is 0 on filesystems without inode numbers
+            if stat.st_ino != 0:
+                with visited_lock:
+                    if (stat.st_dev, stat.st_ino) in visited:
+                        # reached again by a symlink
+                        return files, subdirs
+                    visited.add((stat.st_dev, stat.st_ino))
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if not any(fnmatchcase(entry.name, pattern) for pattern in ignore):
+                            subdirs.append(entry.path)
+                    elif not entry.name.startswith('.') and entry.is_file():
+                        if suffix is None or entry.name.endswith(suffix):
+                            files.append(entry.path)
+        except OSError:
+            if path == dir_path:
+                raise
+            # unreadable subdirectories are skipped
+        return files, subdirs
+
+    paths = []
+    with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='hv_scandir') as executor:
+        pending = {executor.submit(_list_dir, dir_path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                paths.extend(files)
+                # fan out over the subdirectories as soon as they are found
+                pending.update(executor.submit(_list_dir, subdir) for subdir in subdirs)
+    paths.sort(key=natural_key)
+    return paths
+
+
+def natural_key(path):
+    """Sort key for natural sort, i.e., numbers in names are compared as numbers."""
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', path)]
+
+
 def get_img_list(folder, include_names=None, exclude_names=None, exact_exclude_names=None):
     """Get the image list in a folder.
     It also considers 'include' and 'exclude' strings.
 
+    The naturally sorted listing comes from the persistent folder index (see
+    dir_index.list_images), so re-opening a huge folder does not list it again.
+
     Args:
         folder (str): Folder path.
         include_names (list[str]): Included strings in image base names.
@@ -84,11 +174,13 @@ def get_img_list(folder, include_names=None, exclude_names=None, exact_exclude_n
     Returns:
         list[str]: Image list.
     """
+    from handyview.dir_index import list_images
+
     img_list = []
     if folder == '':
         folder = './'
     if exact_exclude_names is not None:
-        for img_path in sorted(scandir(folder, suffix=None, recursive=False, full_path=True)):
+        for img_path in list_images(folder):
             img_path = img_path.replace('\\', '/')
             base, ext = os.path.splitext(os.path.basename(img_path))
             if ext in FORMATS:
@@ -97,7 +189,7 @@ def get_img_list(folder, include_names=None, exclude_names=None, exact_exclude_n
                     img_list.append(img_path)
     else:
         # deal with include and exclude names
-        for img_path in sorted(scandir(folder, suffix=None, recursive=False, full_path=True)):
+        for img_path in list_images(folder):
             img_path = img_path.replace('\\', '/')
             base, ext = os.path.splitext(os.path.basename(img_path))
             if ext in FORMATS:
@@ -115,11 +207,22 @@ def get_img_list(folder, include_names=None, exclude_names=None, exact_exclude_n
                     flag_add = True
                 if flag_add:
                     img_list.append(img_path)
-    # natural sort for numbers in names
-    img_list.sort(key=lambda s: [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', s)])
+    # the listing is already in the natural sort order
     return img_list
 
 
+def get_folder_mtime(folder):
+    """mtime (in nanoseconds) of a folder, which is changed when a file is added, removed or renamed in it.
+
+    Returns:
+        int | None: None if the folder is missing.
+    """
+    try:
+        return os.stat(folder if folder != '' else './').st_mtime_ns
+    except OSError:
+        return None
+
+
 def crop_images(img_list,
                 rect_pos,
                 patch_folder,
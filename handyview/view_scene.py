@@ -4,7 +4,7 @@ for our HandyView.
 """
 from PyQt5 import QtCore
 from PyQt5.QtCore import QPoint, QRect, QSize
-from PyQt5.QtGui import QColor, QFont, QFontMetrics, QTransform
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPen, QPixmap, QTransform
 from PyQt5.QtWidgets import QApplication, QGraphicsScene, QGraphicsView, QRubberBand
 
 
@@ -162,7 +162,13 @@ class HVView(QGraphicsView):
 
     def show_mouse_color(self, x_pos, y_pos):
         """Show mouse color with RGBA values."""
-        pixel = self.parent.qimg.pixel(int(x_pos), int(y_pos))
+        qimg = self.parent.qimg
+        if qimg.isNull():
+            # e.g., the overview of a tiled image is not loaded yet
+            return
+        # the shown image may be a reduced decode
+        ratio = qimg.width() / self.scene().width
+        pixel = qimg.pixel(int(x_pos * ratio), int(y_pos * ratio))
         pixel_color = QColor(pixel)
         self.parent.mouse_color_label.fill(pixel_color)
         rgba = pixel_color.getRgb()  # 8 bit RGBA
@@ -215,10 +221,15 @@ class HVView(QGraphicsView):
 
     def set_transform(self):
         self.setTransform(QTransform().scale(self.zoom, self.zoom).rotate(self.rotate))
+        # swap in the full resolution when zooming past 1:1 of a reduced decode
+        self.parent.refine_image(self)
 
 
 class HVScene(QGraphicsScene):
     """A customized QGraphicsScene for HandyView.
+
+    The scene items are created once and reused for every shown image: a
+    pixmap item (or a tiled item for huge images) and a border item above it.
     """
 
     def __init__(self, parent=None, show_info=True):
@@ -228,9 +239,64 @@ class HVScene(QGraphicsScene):
         self.width = None
         self.height = None
 
+        # the shown image, set by the canvas
+        self.img_path = None
+        self.img_key = None  # cache key of the full resolution, None if it cannot be refined
+        self.qimg = None  # the decoded image of the pixmap
+
+        self.pixmap_item = self.addPixmap(QPixmap())
+        self.tiled_item = None
+        # red border of the main image in compare mode
+        self.border_width = 5
+        self.border_item = self.addRect(0, 0, 0, 0, QPen(QColor(220, 0, 0), self.border_width))
+        self.border_item.setZValue(1)
+        self.border_item.setVisible(False)
+
+    def set_pixmap(self, qpixmap, width, height, scale=1):
+        """Show a pixmap in the reused pixmap item.
+
+        Args:
+            qpixmap (QPixmap): The pixmap, may be a reduced decode.
+            width (int): Image width of the full resolution.
+            height (int): Image height of the full resolution.
+            scale (float): Scale of the pixmap item, so that the scene is in the
+                coordinates of the full resolution. Default: 1.
+        """
+        self.remove_tiled_item()
+        self.pixmap_item.setPixmap(qpixmap)
+        self.pixmap_item.setScale(scale)
+        self.set_width_height(width, height)
+
+    def set_tiled_item(self, tiled_item, width, height):
+        """Show a huge image by a TiledImageItem instead of the pixmap item."""
+        self.remove_tiled_item()
+        self.pixmap_item.setPixmap(QPixmap())
+        self.pixmap_item.setScale(1)
+        self.tiled_item = tiled_item
+        self.addItem(tiled_item)
+        self.set_width_height(width, height)
+
+    def remove_tiled_item(self):
+        if self.tiled_item is not None:
+            self.removeItem(self.tiled_item)
+            self.tiled_item = None
+
+    def set_blank(self):
+        """Show nothing, e.g., as a placeholder of an image not decoded yet."""
+        self.remove_tiled_item()
+        self.pixmap_item.setPixmap(QPixmap())
+
+    def set_border(self, visible):
+        self.border_item.setVisible(visible)
+
     def set_width_height(self, width, height):
         self.width = width
         self.height = height
+        # put image always in the center of a QGraphicsView
+        self.setSceneRect(0, 0, width, height)
+        # the border is inside the image
+        half = self.border_width / 2
+        self.border_item.setRect(half, half, width - self.border_width, height - self.border_width)
 
     def keyPressEvent(self, event):
         modifiers = QApplication.keyboardModifiers()
@@ -262,7 +328,13 @@ class HVScene(QGraphicsScene):
 
     def show_mouse_color(self, x_pos, y_pos):
         """Show mouse color with RGBA values."""
-        pixel = self.parent.qimg.pixel(int(x_pos), int(y_pos))
+        qimg = self.parent.qimg
+        if qimg.isNull():
+            # e.g., the overview of a tiled image is not loaded yet
+            return
+        # the shown image may be a reduced decode
+        ratio = qimg.width() / self.width
+        pixel = qimg.pixel(int(x_pos * ratio), int(y_pos * ratio))
         pixel_color = QColor(pixel)
         self.parent.mouse_color_label.fill(pixel_color)
         rgba = pixel_color.getRgb()  # 8 bit RGBA
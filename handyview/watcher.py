@@ -0,0 +1,106 @@
+"""
+Keep the path lists in step with the folders being viewed: folders are listed
+in the background (FolderScanner), and the path lists follow the files that
+other tools add, remove or rename, without refreshing by hand (FolderWatcher).
+
+Only the folders whose mtime is changed since their path lists were updated
+are listed again (see HVDB.is_folder_changed), in the background, and the
+images moved by the canvas itself are applied to the path lists directly, so
+triaging does not list the folder on every move.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore
+from PyQt5.QtCore import QFileSystemWatcher, QObject
+
+from handyview.utils import get_folder_mtime, get_img_list
+
+# changes within this interval (in ms) are applied together, e.g., a tool writing a batch of images
+WATCH_COALESCE_MS = 300
+
+
+class FolderWatcher(QObject):
+    """Emit folders_changed when files in the watched folders change.
+
+    Only the folder entries are watched (adds, removes, renames). Images
+    rewritten in place are detected by HVDB.apply_folder_changes when the
+    folder is updated next time.
+    """
+    folders_changed = QtCore.pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(FolderWatcher, self).__init__(parent)
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self.on_directory_changed)
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(WATCH_COALESCE_MS)
+        self._timer.timeout.connect(self.folders_changed)
+
+    def set_folders(self, folders):
+        """Watch the given folders (instead of the ones watched before)."""
+        folders = [folder if folder != '' else './' for folder in folders if folder is not None]
+        watched = self._watcher.directories()
+        if watched:
+            self._watcher.removePaths(watched)
+        if folders:
+            self._watcher.addPaths(sorted(set(folders)))
+
+    def on_directory_changed(self, path):
+        # restarted by every change, so a burst of changes is applied once
+        self._timer.start()
+
+
+class FolderScanner(QObject):
+    """List folders (get_img_list) in a background thread.
+
+    scanned(fidx, mtime, paths) is emitted in the GUI thread when the listing of a
+    folder is done, see HVDB.set_scanned_list. rescanned(fidx, folder, mtime,
+    paths, stale_paths) is emitted when a folder is listed again after it is
+    changed, see HVDB.apply_folder_changes.
+    """
+    scanned = QtCore.pyqtSignal(int, object, list)
+    rescanned = QtCore.pyqtSignal(int, str, object, list, list)
+
+    def __init__(self, parent=None):
+        super(FolderScanner, self).__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hv_scan')
+        # scans started before cancel() do not emit their results
+        self._generation = 0
+
+    def scan(self, fidx, folder):
+        self._executor.submit(self._scan, self._generation, fidx, folder)
+
+    def rescan(self, fidx, folder, probed):
+        """List a changed folder again.
+
+        Args:
+            probed (list[tuple]): (path, mtime, size) of the images whose headers
+                are cached, the ones rewritten in place are emitted as stale_paths.
+        """
+        self._executor.submit(self._rescan, self._generation, fidx, folder, probed)
+
+    def cancel(self):
+        self._generation += 1
+
+    def _scan(self, generation, fidx, folder):
+        # the names are filtered by HVDB
+        # read before listing, so that changes while listing are listed again
+        mtime = get_folder_mtime(folder)
+        paths = get_img_list(folder)
+        if generation == self._generation:
+            self.scanned.emit(fidx, mtime, paths)
+
+    def _rescan(self, generation, fidx, folder, probed):
+        mtime = get_folder_mtime(folder)
+        paths = get_img_list(folder)
+        stale_paths = []
+        for path, mtime_ns, size in probed:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+                stale_paths.append(path)
+        if generation == self._generation:
+            self.rescanned.emit(fidx, folder, mtime, paths, stale_paths)
@@ -5,7 +5,8 @@ Include customized widgets used in HandyView.
 import os
 from PyQt5 import QtCore
 from PyQt5.QtGui import QColor, QFont, QIcon, QPixmap
-from PyQt5.QtWidgets import QDialog, QFrame, QHBoxLayout, QLabel, QMessageBox, QPushButton, QVBoxLayout
+from PyQt5.QtWidgets import (QDialog, QFrame, QHBoxLayout, QLabel, QLineEdit, QListWidget, QListWidgetItem, QMessageBox,
+                             QPushButton, QVBoxLayout)
 
 from handyview.utils import ROOT_DIR
 
@@ -134,3 +135,60 @@ class MessageDialog(QDialog):
 
     def setText(self, text):
         self.text_label.setText(text)
+
+
+class GotoFileDialog(QDialog):
+    """Type-ahead dialog for going to an image by (part of) its name.
+
+    The matches are updated on every keystroke. Enter (or double click) goes
+    to the selected match, and the up and down keys move the selection.
+
+    Args:
+        find_paths (callable): Get the (index, path) of the images matching a
+            query, e.g., HVDB.find_paths.
+    """
+
+    def __init__(self, parent, find_paths):
+        super(GotoFileDialog, self).__init__(parent)
+        self.setWindowTitle('Go to file')
+        self.find_paths = find_paths
+        # index of the chosen image
+        self.index = None
+
+        self.line_edit = QLineEdit(self)
+        self.line_edit.setPlaceholderText('Part of the file name')
+        self.line_edit.textEdited.connect(self.update_matches)
+        self.line_edit.returnPressed.connect(self.accept_match)
+        self.line_edit.installEventFilter(self)
+        self.match_list = QListWidget(self)
+        self.match_list.itemActivated.connect(self.accept_match)
+
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.line_edit)
+        self.layout.addWidget(self.match_list)
+        self.setLayout(self.layout)
+        self.resize(500, 400)
+
+    def update_matches(self, text):
+        self.match_list.clear()
+        for index, path in self.find_paths(text):
+            item = QListWidgetItem(f'{index + 1}: {os.path.basename(path)}', self.match_list)
+            item.setData(QtCore.Qt.UserRole, index)
+        if self.match_list.count() > 0:
+            self.match_list.setCurrentRow(0)
+
+    def eventFilter(self, obj, event):
+        # browse the matches while typing
+        if (obj is self.line_edit and event.type() == QtCore.QEvent.KeyPress
+                and event.key() in (QtCore.Qt.Key_Up, QtCore.Qt.Key_Down)):
+            step = -1 if event.key() == QtCore.Qt.Key_Up else 1
+            row = min(max(self.match_list.currentRow() + step, 0), self.match_list.count() - 1)
+            self.match_list.setCurrentRow(row)
+            return True
+        return super(GotoFileDialog, self).eventFilter(obj, event)
+
+    def accept_match(self):
+        item = self.match_list.currentItem()
+        if item is not None:
+            self.index = item.data(QtCore.Qt.UserRole)
+            self.accept()
@@ -0,0 +1,55 @@
+import os
+
+import handyview.db
+from handyview.db import HVDB
+
+NAMES = ['a_0.png', 'a_1.png', 'b_0.png', 'b_1.png']
+
+
+def get_db(tmp_path, monkeypatch):
+    # the history of opened images is kept in ROOT_DIR
+    monkeypatch.setattr(handyview.db, 'ROOT_DIR', str(tmp_path))
+    for name in NAMES:
+        (tmp_path / name).write_bytes(b'')
+    return HVDB(str(tmp_path / NAMES[0]))
+
+
+def set_include_names(db, include_names):
+    db.include_names = include_names
+    db.apply_filters()
+    return [os.path.basename(path) for path in db.path_list[0]]
+
+
+def test_restore_moved(tmp_path, monkeypatch):
+    db = get_db(tmp_path, monkeypatch)
+    db.set_moved(0, 1)
+    assert db.restore_moved(os.path.abspath(db.path_list[0][1])) == (0, 1)
+    assert not db.tables[0].moved.any()
+    # the restored image is shown in the filtered view
+    db.set_moved(0, 2)
+    assert set_include_names(db, ['b_']) == ['b_0.png', 'b_1.png']
+    assert db.restore_moved(str(tmp_path / 'b_0.png')) == (0, 0)
+    assert not db.tables[0].moved.any()
+    set_include_names(db, None)
+    assert not db.tables[0].moved.any()
+
+
+def test_restore_filtered_out(tmp_path, monkeypatch):
+    db = get_db(tmp_path, monkeypatch)
+    # moved, then filtered out before it is restored
+    db.set_moved(0, 1)
+    assert set_include_names(db, ['b_']) == ['b_0.png', 'b_1.png']
+    assert db.restore_moved(str(tmp_path / 'a_1.png')) is None
+    set_include_names(db, None)
+    assert not db.tables[0].moved.any()
+    assert db.restore_moved(str(tmp_path / 'a_1.png')) is None
+
+
+def test_find_paths_moved(tmp_path, monkeypatch):
+    db = get_db(tmp_path, monkeypatch)
+    db.set_moved(0, 0)
+    db.find_paths('')
+    db._name_index._future.result()
+    # the moved a_0.png does not count toward the limit
+    assert [pidx for pidx, _ in db.find_paths('a_', limit=1)] == [1]
+    assert [pidx for pidx, _ in db.find_paths('_0', limit=1)] == [2]
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+
+import pytest
+
+from handyview import dir_index
+
+
+@pytest.fixture
+def index_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache' / 'dir_index.sqlite')
+    monkeypatch.setattr(dir_index, 'DIR_INDEX_PATH', path)
+    monkeypatch.setattr(dir_index, 'DIR_INDEX_MIN_IMAGES', 1)
+    monkeypatch.setattr(dir_index, '_initialized', False)
+    return path
+
+
+def make_folder(path, names):
+    os.makedirs(path)
+    for name in names:
+        with open(os.path.join(path, name), 'wb'):
+            pass
+    return path
+
+
+def get_folders(index_path):
+    with sqlite3.connect(index_path) as conn:
+        return sorted(folder for folder, in conn.execute('SELECT folder FROM folders'))
+
+
+def test_list_images(tmp_path, index_path, monkeypatch):
+    folder = make_folder(str(tmp_path / 'a'), ['img10.png', 'img2.png', 'img1.png', 'notes.txt'])
+    expected = [os.path.join(folder, name) for name in ['img1.png', 'img2.png', 'img10.png']]
+    assert dir_index.list_images(folder) == expected
+    # listed from the index
+    with monkeypatch.context() as patch:
+        patch.setattr(dir_index, 'scan_images', None)
+        assert dir_index.list_images(folder) == expected
+    # listed again after the folder is changed
+    os.remove(os.path.join(folder, 'img2.png'))
+    assert dir_index.list_images(folder) == expected[::2]
+
+
+def test_prune(tmp_path, index_path, monkeypatch):
+    old = make_folder(str(tmp_path / 'old'), ['a.png'])
+    new = make_folder(str(tmp_path / 'new'), ['b.png'])
+    dir_index.list_images(old)
+    os.rename(old, old + '_renamed')
+    dir_index.list_images(new)
+    # not pruned until it is unused for DIR_INDEX_MAX_AGE
+    assert get_folders(index_path) == sorted([os.path.realpath(old), os.path.realpath(new)])
+    monkeypatch.setattr(dir_index, 'DIR_INDEX_MAX_AGE', -10)
+    make_folder(os.path.join(new, 'sub'), [])
+    dir_index.list_images(new)
+    assert get_folders(index_path) == [os.path.realpath(new)]
+
+
+def test_former_version(tmp_path, index_path):
+    os.makedirs(os.path.dirname(index_path))
+    with sqlite3.connect(index_path) as conn:
+        conn.execute('CREATE TABLE folders (folder TEXT PRIMARY KEY, mtime INTEGER)')
+        conn.execute('CREATE TABLE images (folder TEXT, pos INTEGER, name TEXT, size INTEGER, mtime INTEGER)')
+    folder = make_folder(str(tmp_path / 'a'), ['a.png'])
+    assert dir_index.list_images(folder) == [os.path.join(folder, 'a.png')]
+    assert get_folders(index_path) == [os.path.realpath(folder)]
@@ -0,0 +1,39 @@
+import re
+
+from handyview.columns import PathColumn
+from handyview.filters import NameFilter
+
+NAMES = ['g1.png', 'g2.png', 'img_0.png', 'img_12.png', 'a*b.png', 'x[1].jpg', 'img 1.png']
+
+
+def get_shown(include_names=None, exclude_names=None, names=NAMES):
+    paths = PathColumn([f'/data/{name}' for name in names])
+    mask = NameFilter(include_names, exclude_names)(paths)
+    assert len(mask) == len(paths)
+    return [name for name, shown in zip(names, mask) if shown]
+
+
+def test_substring():
+    assert get_shown(['img']) == ['img_0.png', 'img_12.png', 'img 1.png']
+    assert get_shown(exclude_names=['img', 'g1']) == ['g2.png', 'a*b.png', 'x[1].jpg']
+    # the extension is not matched
+    assert get_shown(['png']) == []
+    # the glob characters are literal in plain terms
+    assert get_shown(['a*b']) == ['a*b.png']
+    assert get_shown(['x[1]']) == ['x[1].jpg']
+
+
+def test_glob():
+    assert get_shown(['glob:img_*']) == ['img_0.png', 'img_12.png']
+    assert get_shown(['glob:g?']) == ['g1.png', 'g2.png']
+    assert get_shown(['glob:img_[!0]*']) == ['img_12.png']
+
+
+def test_regex():
+    assert get_shown(['re:^img_\\d$']) == ['img_0.png']
+    # patterns that match a newline do not cross the names
+    assert get_shown(['re:g[^x]*2']) == ['g2.png', 'img_12.png']
+    assert get_shown(['re:g_[^x]*2']) == ['img_12.png']
+    assert get_shown(exclude_names=['re:1\\s']) == [name for name in NAMES if not re.search('1\\s', name[:-4])]
+    assert get_shown(exclude_names=['re:\\D$', 'img']) == ['g1.png', 'g2.png']
+    assert get_shown(['re:\\s', 'g1']) == ['g1.png', 'img 1.png']
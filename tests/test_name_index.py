@@ -0,0 +1,34 @@
+import numpy as np
+
+from handyview.columns import PathColumn
+from handyview.name_index import NameIndex
+
+NAMES = ['cat_0.png', 'cat_1.png', 'dog_0.png', 'my_cat.png', 'cat_2.png', 'hotdog.png']
+
+
+def get_index():
+    index = NameIndex(PathColumn([f'/data/{name}' for name in NAMES]))
+    index._future.result()
+    return index
+
+
+def test_search():
+    index = get_index()
+    # the names starting with the query first
+    assert index.search('cat') == [0, 1, 4, 3]
+    assert index.search('CAT', limit=2) == [0, 1]
+    assert index.search('dog') == [2, 5]
+    assert index.search('og') == [2, 5]
+    assert index.search('bird') == []
+    assert index.scan('cat') == [0, 1, 3, 4]
+
+
+def test_search_skip():
+    index = get_index()
+    skip = np.array([True, True, False, False, False, True])
+    # the skipped rows do not count toward the limit
+    assert index.search('cat', limit=1, skip=skip) == [4]
+    assert index.search('cat', limit=2, skip=skip) == [4, 3]
+    assert index.search('dog', limit=1, skip=skip) == [2]
+    assert index.search('og', limit=1, skip=skip) == [2]
+    assert index.scan('cat', limit=1, skip=skip) == [3]
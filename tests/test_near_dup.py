@@ -0,0 +1,75 @@
+import numpy as np
+
+from handyview.near_dup import PhashIndex, popcount, similarity_order
+
+
+def get_phashes(seed, num=600):
+    """Random phashes, with near-duplicates (a few bits flipped) and copies."""
+    rng = np.random.default_rng(seed)
+    phashes = rng.integers(0, 2**64 - 1, size=num, dtype=np.uint64, endpoint=True)
+    third = num // 3
+    flips = np.uint64(1) << rng.integers(0, 64, third).astype(np.uint64)
+    phashes[third:2 * third] = phashes[:third] ^ flips ^ (np.uint64(3) << rng.integers(0, 62, third).astype(np.uint64))
+    phashes[2 * third:2 * third + third // 4] = phashes[:third // 4]
+    return phashes[rng.permutation(num)]
+
+
+def brute_force_groups(phashes, distance):
+    """Connected components of the pairwise Hamming distances, by union-find."""
+    parents = list(range(len(phashes)))
+
+    def find(idx):
+        while parents[idx] != idx:
+            parents[idx] = parents[parents[idx]]
+            idx = parents[idx]
+        return idx
+
+    for idx in range(len(phashes)):
+        for other in np.flatnonzero(popcount(phashes ^ phashes[idx]) <= distance).tolist():
+            root, other_root = find(idx), find(other)
+            if root != other_root:
+                parents[max(root, other_root)] = min(root, other_root)
+    groups = {}
+    for idx in range(len(phashes)):
+        groups.setdefault(find(idx), []).append(idx)
+    return sorted(group for group in groups.values() if len(group) > 1)
+
+
+def test_search():
+    phashes = get_phashes(0)
+    index = PhashIndex(phashes)
+    for distance in (0, 3, 6, 9):
+        for query in range(0, len(phashes), 37):
+            found, distances = index.search(phashes[query], distance)
+            expected = popcount(phashes ^ phashes[query])
+            assert sorted(found.tolist()) == np.flatnonzero(expected <= distance).tolist()
+            assert distances.tolist() == sorted(expected[found].tolist())
+
+
+def test_group():
+    # distinct phashes, whose index order differs from the sorted order
+    phashes = np.array([0xFFFF000000000000, 1, 3, 0xF0F0F0F0F0F0F0F0], dtype=np.uint64)
+    assert [group.tolist() for group in PhashIndex(phashes).group(6)] == [[1, 2]]
+    for seed in range(3):
+        for num in (600, 100):
+            phashes = get_phashes(seed, num)
+            distinct = np.unique(phashes)[np.random.default_rng(seed).permutation(len(np.unique(phashes)))]
+            for values in (phashes, distinct):
+                for distance in (0, 2, 6):
+                    groups = [group.tolist() for group in PhashIndex(values).group(distance)]
+                    assert groups == brute_force_groups(values, distance)
+
+
+def test_similarity_order():
+    phashes = np.array([0xF0F0F0F0F0F0F0F0, 1, 0xFFFF000000000000, 3], dtype=np.uint64)
+    order = similarity_order(phashes).tolist()
+    assert abs(order.index(1) - order.index(3)) == 1
+    for seed in range(3):
+        phashes = get_phashes(seed)
+        order = similarity_order(phashes, 6)
+        assert sorted(order.tolist()) == list(range(len(phashes)))
+        # the members of each near-duplicate group are next to each other
+        positions = np.argsort(order)
+        for group in brute_force_groups(phashes, 6):
+            group_positions = np.sort(positions[group])
+            assert group_positions[-1] - group_positions[0] == len(group) - 1